@@ -0,0 +1,349 @@
+import os
+import time
+import glob
+import socket
+import hashlib
+import sqlite3
+import datetime
+import threading
+from storage import DATA_FOLDER, data_path, connect_db
+
+# --- 配置 ---
+DEFAULT_CATALOG_PATH = data_path('catalog.db')
+# 进程心跳间隔；其他主机上的进程超过 LEASE_SECONDS 未刷新心跳即视为已退出
+HEARTBEAT_SECONDS = 10
+LEASE_SECONDS = 60
+
+HOST = socket.gethostname()
+# 本进程的启动时间，与主机名和 PID 一起标识进程，避免 PID 被重启后的无关进程复用时误判为存活
+PROCESS_STARTED = datetime.datetime.now().isoformat(timespec='microseconds')
+
+# --- 媒体条目状态 ---
+STATUS_UPLOADED = 'uploaded'          # 文件已保存，尚未开始转写
+STATUS_TRANSCRIBING = 'transcribing'  # 正在转写 (进程崩溃后仍处于该状态)
+STATUS_TRANSCRIBED = 'transcribed'    # 最终 VTT 已生成
+STATUS_FAILED = 'failed'
+STATUS_CANCELLED = 'cancelled'        # 被用户或空闲超时取消，已完成的分块保留，可继续转写
+
+# 所属进程已退出时需要恢复的状态
+INTERRUPTED_STATUSES = (STATUS_UPLOADED, STATUS_TRANSCRIBING)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    base_filename TEXT PRIMARY KEY,
+    original_filename TEXT,
+    media_path TEXT,
+    content_hash TEXT,
+    duration REAL,
+    num_chunks INTEGER,
+    chunks_done INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    error TEXT,
+    vtt_path TEXT,
+    summary_path TEXT,
+    summary_json_path TEXT,
+    transcript_version INTEGER NOT NULL DEFAULT 0,
+    summary_version INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    transcribed_at TEXT,
+    summarized_at TEXT,
+    owner_pid INTEGER,
+    owner_host TEXT,
+    owner_started TEXT
+);
+CREATE INDEX IF NOT EXISTS media_status ON media (status);
+CREATE INDEX IF NOT EXISTS media_updated_at ON media (updated_at);
+CREATE TABLE IF NOT EXISTS processes (
+    host TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    heartbeat_at REAL NOT NULL,
+    priority INTEGER,
+    PRIMARY KEY (host, pid)
+);
+"""
+
+# 旧版本数据库中缺少、需要在连接时补充的列 (表, 列, 类型)
+_ADDED_COLUMNS = (('media', 'owner_pid', 'INTEGER'), ('media', 'owner_host', 'TEXT'), ('media', 'owner_started', 'TEXT'),
+                  ('processes', 'priority', 'INTEGER'))
+
+_COLUMNS = (
+    'base_filename', 'original_filename', 'media_path', 'content_hash', 'duration', 'num_chunks',
+    'chunks_done', 'status', 'error', 'vtt_path', 'summary_path', 'summary_json_path',
+    'transcript_version', 'summary_version', 'created_at', 'updated_at', 'transcribed_at', 'summarized_at',
+    'owner_pid', 'owner_host', 'owner_started'
+)
+
+def _now():
+    return datetime.datetime.now().isoformat(timespec='seconds')
+
+def connect(catalog_path=DEFAULT_CATALOG_PATH):
+    conn = connect_db(catalog_path, _SCHEMA)
+    existing = {}
+    for table, name, declaration in _ADDED_COLUMNS:
+        if table not in existing:
+            existing[table] = {row['name'] for row in conn.execute(f'PRAGMA table_info({table})')}
+        if name not in existing[table]:
+            try:
+                conn.execute(f'ALTER TABLE {table} ADD COLUMN {name} {declaration}')
+            except sqlite3.OperationalError:
+                pass  # 另一个进程已同时添加了该列
+    return conn
+
+def file_sha256(path, block_size=1024 * 1024):
+    """流式计算文件的 SHA-256，避免一次性读入大文件。"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _execute(sql, params=(), catalog_path=DEFAULT_CATALOG_PATH):
+    conn = connect(catalog_path)
+    try:
+        with conn:
+            conn.execute(sql, params)
+    finally:
+        conn.close()
+
+def _query(sql, params=(), catalog_path=DEFAULT_CATALOG_PATH):
+    conn = connect(catalog_path)
+    try:
+        return [dict(row) for row in conn.execute(sql, params)]
+    finally:
+        conn.close()
+
+def upsert_media(base_filename, catalog_path=DEFAULT_CATALOG_PATH, **fields):
+    """
+    在一个事务中插入或更新媒体条目。只修改传入的字段，updated_at 自动更新。
+    """
+    unknown = set(fields) - set(_COLUMNS)
+    if unknown:
+        raise ValueError(f"未知的目录字段: {sorted(unknown)}")
+    now = _now()
+    fields = dict(fields, updated_at=now)
+    insert_fields = dict({'status': STATUS_UPLOADED, 'created_at': now}, **fields)
+    columns = ['base_filename'] + list(insert_fields)
+    assignments = ', '.join(f"{name} = excluded.{name}" for name in fields)
+    _execute(
+        f"INSERT INTO media ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+        f"ON CONFLICT (base_filename) DO UPDATE SET {assignments}",
+        [base_filename] + list(insert_fields.values()),
+        catalog_path
+    )
+
+def get_media(base_filename, catalog_path=DEFAULT_CATALOG_PATH):
+    """按文件名查询单个媒体条目，不存在时返回 None。"""
+    rows = _query('SELECT * FROM media WHERE base_filename = ?', (base_filename,), catalog_path)
+    return rows[0] if rows else None
+
+def list_media(status=None, limit=100, offset=0, catalog_path=DEFAULT_CATALOG_PATH):
+    """按最近更新时间倒序列出媒体条目，可按状态过滤。"""
+    if status:
+        return _query('SELECT * FROM media WHERE status = ? ORDER BY updated_at DESC LIMIT ? OFFSET ?',
+                      (status, limit, offset), catalog_path)
+    return _query('SELECT * FROM media ORDER BY updated_at DESC LIMIT ? OFFSET ?', (limit, offset), catalog_path)
+
+def count_by_status(catalog_path=DEFAULT_CATALOG_PATH):
+    """返回 {状态: 条目数}。"""
+    rows = _query('SELECT status, COUNT(*) AS count FROM media GROUP BY status', (), catalog_path)
+    return {row['status']: row['count'] for row in rows}
+
+def find_interrupted(catalog_path=DEFAULT_CATALOG_PATH):
+    """
+    查找未完成转写、源文件路径已知、且所属进程已退出的条目。
+    仍由其他存活进程 (例如正在运行的批处理) 转写的条目不会被返回。
+    """
+    placeholders = ', '.join('?' * len(INTERRUPTED_STATUSES))
+    rows = _query(
+        f"SELECT * FROM media WHERE status IN ({placeholders}) AND media_path IS NOT NULL ORDER BY updated_at",
+        INTERRUPTED_STATUSES, catalog_path
+    )
+    return [row for row in rows
+            if not owner_alive(row['owner_pid'], row['owner_host'], row['owner_started'], catalog_path)]
+
+def _owner_fields():
+    return {'owner_pid': os.getpid(), 'owner_host': HOST, 'owner_started': PROCESS_STARTED}
+
+def mark_uploaded(base_filename, original_filename, media_path, content_hash, catalog_path=DEFAULT_CATALOG_PATH):
+    upsert_media(base_filename, catalog_path, original_filename=original_filename,
+                 media_path=os.path.abspath(media_path), content_hash=content_hash, status=STATUS_UPLOADED,
+                 error=None, chunks_done=0, **_owner_fields())
+
+def start_transcription(base_filename, media_path, duration, num_chunks, chunks_done,
+                        catalog_path=DEFAULT_CATALOG_PATH):
+    """记录转写开始，并将条目归属到当前进程，其他进程不会把它当作中断的任务恢复。"""
+    upsert_media(base_filename, catalog_path, media_path=os.path.abspath(media_path), duration=duration,
+                 num_chunks=num_chunks, chunks_done=chunks_done, status=STATUS_TRANSCRIBING, error=None,
+                 **_owner_fields())
+
+def update_progress(base_filename, chunks_done, catalog_path=DEFAULT_CATALOG_PATH):
+    upsert_media(base_filename, catalog_path, chunks_done=chunks_done)
+
+def complete_transcription(base_filename, vtt_path, catalog_path=DEFAULT_CATALOG_PATH):
+    """记录转写完成。字幕版本号加一，旧摘要随之失效。"""
+    now = _now()
+    _execute(
+        """
+        UPDATE media SET status = ?, vtt_path = ?, chunks_done = num_chunks, error = NULL,
+            transcript_version = transcript_version + 1, transcribed_at = ?, updated_at = ?,
+            summary_path = NULL, summary_json_path = NULL
+        WHERE base_filename = ?
+        """,
+        (STATUS_TRANSCRIBED, vtt_path, now, now, base_filename), catalog_path
+    )
+
+def fail_transcription(base_filename, error, catalog_path=DEFAULT_CATALOG_PATH):
+    upsert_media(base_filename, catalog_path, status=STATUS_FAILED, error=error)
+
+def cancel_transcription(base_filename, reason, catalog_path=DEFAULT_CATALOG_PATH):
+    upsert_media(base_filename, catalog_path, status=STATUS_CANCELLED, error=f"已取消: {reason}")
+
+def record_summary(base_filename, summary_path, summary_json_path, catalog_path=DEFAULT_CATALOG_PATH):
+    """记录摘要产物。摘要版本号加一。"""
+    now = _now()
+    _execute(
+        """
+        UPDATE media SET summary_path = ?, summary_json_path = ?, summary_version = summary_version + 1,
+            summarized_at = ?, updated_at = ?
+        WHERE base_filename = ?
+        """,
+        (summary_path, summary_json_path, now, now, base_filename), catalog_path
+    )
+
+def sync_from_disk(data_folder=DATA_FOLDER, allowed_extensions=(), catalog_path=DEFAULT_CATALOG_PATH):
+    """
+    为 data/ 中已存在、但尚未登记的视频目录补充目录条目 (一次性迁移旧数据)。
+    已登记的条目不会被修改。返回新登记的条目数。
+    """
+    known = {row['base_filename'] for row in _query('SELECT base_filename FROM media', (), catalog_path)}
+    added = 0
+    for name in sorted(os.listdir(data_folder)):
+        video_folder = os.path.join(data_folder, name)
+        if name in known or not os.path.isdir(video_folder):
+            continue
+
+        vtt_path = os.path.join(video_folder, f"{name}.vtt")
+        summary_path = os.path.join(video_folder, f"{name}.md")
+        summary_json_path = os.path.join(video_folder, f"{name}-summary.json")
+        media_paths = [path for path in glob.glob(os.path.join(video_folder, f"{glob.escape(name)}.*"))
+                       if path.rsplit('.', 1)[1].lower() in allowed_extensions]
+
+        fields = {'media_path': os.path.abspath(media_paths[0]) if media_paths else None}
+        if os.path.exists(vtt_path):
+            fields.update(status=STATUS_TRANSCRIBED, vtt_path=vtt_path, transcript_version=1)
+            if os.path.exists(summary_path):
+                fields.update(summary_path=summary_path, summary_version=1)
+            if os.path.exists(summary_json_path):
+                fields.update(summary_json_path=summary_json_path)
+        elif os.path.isdir(os.path.join(video_folder, 'tmp')):
+            fields.update(status=STATUS_TRANSCRIBING)
+        elif media_paths:
+            fields.update(status=STATUS_UPLOADED)
+        else:
+            continue
+
+        upsert_media(name, catalog_path, **fields)
+        added += 1
+    return added
+
+# --- 进程心跳：判断条目的所属进程是否仍在运行 ---
+
+def _pid_alive(pid):
+    if pid == os.getpid():
+        return True
+    if os.name == 'nt':
+        # Windows 上 os.kill 会终止目标进程，改为查询进程退出码
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        try:
+            exit_code = ctypes.c_ulong()
+            if not kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code)):
+                return True
+            return exit_code.value == 259  # STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def owner_alive(pid, host, started=None, catalog_path=DEFAULT_CATALOG_PATH):
+    """
+    判断条目的所属进程是否仍在运行：processes 表中必须有同一进程 (主机、PID、启动时间) 在
+    LEASE_SECONDS 内刷新过的心跳；本机进程还要求 PID 仍然存在。
+    只看 PID 不够：崩溃或重启后 PID 可能被无关进程复用。没有记录所属进程的旧条目视为已退出。
+    """
+    if pid is None:
+        return False
+    if host == HOST and pid == os.getpid() and started == PROCESS_STARTED:
+        return True
+    if host == HOST and not _pid_alive(pid):
+        return False
+    sql = 'SELECT 1 FROM processes WHERE host = ? AND pid = ? AND heartbeat_at > ?'
+    params = [host, pid, time.time() - LEASE_SECONDS]
+    if started is not None:
+        sql += ' AND started_at = ?'
+        params.append(started)
+    return bool(_query(sql, params, catalog_path))
+
+def heartbeat(role, priority=None, catalog_path=DEFAULT_CATALOG_PATH):
+    """
+    登记当前进程或刷新其心跳。priority 为本进程中等待或正在运行的转写任务的最高优先级，
+    没有任务时为 None；其他进程据此决定是否让出 GPU (见 max_other_priority)。
+    """
+    _execute(
+        "INSERT INTO processes (host, pid, role, started_at, heartbeat_at, priority) VALUES (?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (host, pid) DO UPDATE SET role = excluded.role, started_at = excluded.started_at, "
+        "heartbeat_at = excluded.heartbeat_at, "
+        "priority = excluded.priority",
+        (HOST, os.getpid(), role, PROCESS_STARTED, time.time(), priority), catalog_path
+    )
+
+def max_other_priority(catalog_path=DEFAULT_CATALOG_PATH):
+    """返回其他存活进程登记的最高任务优先级，没有进程登记任务时返回 None。"""
+    rows = _query(
+        'SELECT host, pid, priority FROM processes WHERE priority IS NOT NULL AND heartbeat_at > ? '
+        'AND NOT (host = ? AND pid = ?)',
+        (time.time() - LEASE_SECONDS, HOST, os.getpid()), catalog_path
+    )
+    priorities = [row['priority'] for row in rows if row['host'] != HOST or _pid_alive(row['pid'])]
+    return max(priorities, default=None)
+
+def unregister_process(catalog_path=DEFAULT_CATALOG_PATH):
+    _execute('DELETE FROM processes WHERE host = ? AND pid = ?', (HOST, os.getpid()), catalog_path)
+
+def start_heartbeat(role, interval=HEARTBEAT_SECONDS, demand=None, on_other_priority=None,
+                    catalog_path=DEFAULT_CATALOG_PATH):
+    """
+    在后台线程中定期刷新当前进程的心跳，返回一个 threading.Event，set() 后停止心跳并注销进程。
+    demand() 返回本进程当前的最高任务优先级并随心跳一同登记；
+    每次心跳后以其他进程的最高优先级调用 on_other_priority，用于在进程之间共享转写槽位。
+    """
+    stop = threading.Event()
+
+    def beat():
+        while True:
+            try:
+                heartbeat(role, demand() if demand else None, catalog_path)
+                if on_other_priority:
+                    on_other_priority(max_other_priority(catalog_path))
+            except Exception as e:
+                print(f"刷新进程心跳失败: {e}")
+            if stop.wait(interval):
+                break
+        try:
+            unregister_process(catalog_path)
+        except Exception as e:
+            print(f"注销进程失败: {e}")
+
+    threading.Thread(target=beat, daemon=True).start()
+    return stop
@@ -75,14 +75,23 @@ const Subtitles: Component<SubtitlesProps> = (props) => {
   const connectAndListen = (fileToUpload?: File) => {
     disconnectSocket(); // 确保旧连接已断开
     socket = io('http://127.0.0.1:5000');
+    // 已上传的文件名：断线重连后只用新的会话 ID 重新订阅任务，不再重复上传
+    let uploadedFilename: string | null = null;
 
     socket.on('connect', () => {
       console.log('Connected to WebSocket server.');
-      
+
+      if (uploadedFilename) {
+        socket?.emit('subscribe_job', { filename: uploadedFilename });
+        return;
+      }
+
       // 只有在需要上传文件时（即字幕不存在的情况下）才执行上传
       if (fileToUpload) {
         const formData = new FormData();
         formData.append('file', fileToUpload);
+        // 随上传提交 Socket.IO 会话 ID，服务器据此订阅转写任务：关闭页面后任务会在空闲超时后自动取消
+        if (socket?.id) formData.append('sid', socket.id);
 
         setMessage(t('subtitles.messages.uploading'));
         fetch('http://127.0.0.1:5000/upload', {
@@ -92,6 +101,7 @@ const Subtitles: Component<SubtitlesProps> = (props) => {
         .then(response => response.json())
         .then(uploadData => {
           if (uploadData.message) {
+            uploadedFilename = uploadData.filename;
             setMessage(uploadData.message); // Assuming server sends back a translated message key or plain text
           } else {
             setMessage(t('subtitles.messages.uploadFailed', { error: uploadData.error || t('subtitles.messages.unknownError') }));
@@ -167,6 +177,13 @@ const Subtitles: Component<SubtitlesProps> = (props) => {
       }
     });
 
+    socket.on('transcription_cancelled', (data: any) => {
+      // 使用原始文件名进行精确匹配
+      if (data.original_filename !== selectedFile()?.name) return;
+      setMessage(t('subtitles.messages.processingError', { message: data.reason }));
+      disconnectSocket();
+    });
+
     socket.on('transcription_error', (data: any) => {
       // 使用原始文件名进行精确匹配
       if (data.original_filename !== selectedFile()?.name) return;
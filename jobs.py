@@ -0,0 +1,304 @@
+import time
+import itertools
+import threading
+
+# --- 任务状态 ---
+STATE_QUEUED = 'queued'        # 等待转写槽位
+STATE_RUNNING = 'running'
+STATE_PAUSED = 'paused'        # 已在分块边界暂停并让出槽位
+STATE_CANCELLED = 'cancelled'
+STATE_COMPLETED = 'completed'
+STATE_FAILED = 'failed'
+
+FINISHED_STATES = (STATE_CANCELLED, STATE_COMPLETED, STATE_FAILED)
+
+# --- 默认优先级 (数值越大越优先) ---
+PRIORITY_INTERACTIVE = 10
+PRIORITY_BACKGROUND = 0
+
+DEFAULT_MAX_RUNNING = 1
+DEFAULT_IDLE_CANCEL_SECONDS = 300
+
+class TranscriptionJob:
+    """
+    一个转写任务的控制状态。转写循环在每个分块之间调用 checkpoint()，
+    由 JobManager 决定继续、暂停、让出槽位给更高优先级的任务或取消。
+    """
+
+    def __init__(self, manager, seq, base_filename, original_filename, audio_file, priority, interactive):
+        self.manager = manager
+        self.seq = seq
+        self.base_filename = base_filename
+        self.original_filename = original_filename
+        self.audio_file = audio_file
+        self.priority = priority
+        self.interactive = interactive
+        self.state = STATE_QUEUED
+        self.cancel_requested = False
+        self.pause_requested = False
+        self.cancel_reason = None
+        self.subscribers = set()
+        self.ever_subscribed = False
+        self.unsubscribed_at = time.time()
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def checkpoint(self):
+        """在分块之间调用。返回 False 表示任务已被取消，调用方应立即停止。"""
+        return self.manager.checkpoint(self)
+
+    def as_dict(self):
+        return {
+            'filename': self.base_filename,
+            'original_filename': self.original_filename,
+            'state': self.state,
+            'priority': self.priority,
+            'interactive': self.interactive,
+            'pause_requested': self.pause_requested,
+            'cancel_requested': self.cancel_requested,
+            'cancel_reason': self.cancel_reason,
+            'subscribers': len(self.subscribers),
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+
+class JobManager:
+    """
+    管理所有转写任务：限制同时运行的任务数 (共享同一个 Whisper 模型)，
+    按优先级分配槽位，并处理取消、暂停/恢复、优先级调整和无订阅者自动取消。
+    所有状态变化都会通过 on_change 回调通知 (例如广播 Socket.IO 事件)。
+    其他进程 (例如服务器与批处理) 的任务优先级通过 set_external_priority 传入，
+    低于该优先级的任务会在分块边界让出槽位，直到其他进程的任务完成。
+    """
+
+    def __init__(self, max_running=DEFAULT_MAX_RUNNING, idle_cancel_seconds=DEFAULT_IDLE_CANCEL_SECONDS,
+                 on_change=None):
+        self.max_running = max_running
+        self.idle_cancel_seconds = idle_cancel_seconds
+        self.on_change = on_change
+        self.cond = threading.Condition()
+        self.jobs = {}
+        self.running = set()
+        self.external_priority = None
+        self._seq = itertools.count()
+
+    def configure(self, max_running=None, idle_cancel_seconds=None):
+        with self.cond:
+            if max_running is not None:
+                self.max_running = max(int(max_running), 1)
+            if idle_cancel_seconds is not None:
+                self.idle_cancel_seconds = idle_cancel_seconds
+            self.cond.notify_all()
+
+    def set_external_priority(self, priority):
+        """更新其他进程中等待或正在运行的任务的最高优先级 (None 表示没有)。"""
+        with self.cond:
+            if priority == self.external_priority:
+                return
+            self.external_priority = priority
+            self.cond.notify_all()
+
+    def demand(self):
+        """返回本进程中等待或正在运行的任务的最高优先级，没有时返回 None。"""
+        with self.cond:
+            active = [j.priority for j in self.jobs.values()
+                      if j.state in (STATE_QUEUED, STATE_RUNNING) and not j.pause_requested
+                      and not j.cancel_requested]
+            return max(active, default=None)
+
+    # --- 任务生命周期 ---
+
+    def submit(self, base_filename, original_filename, audio_file, priority=PRIORITY_INTERACTIVE,
+               interactive=True):
+        """
+        登记一个新任务。同名任务仍在进行时不重复创建，返回 (job, created)。
+        """
+        with self.cond:
+            job = self.jobs.get(base_filename)
+            if job and job.state not in FINISHED_STATES:
+                return job, False
+            job = TranscriptionJob(self, next(self._seq), base_filename, original_filename, audio_file,
+                                   priority, interactive)
+            if interactive:
+                # 上传完成时客户端通常已连接，沿用之前对该文件的订阅
+                old = self.jobs.get(base_filename)
+                if old and old.subscribers:
+                    job.subscribers = set(old.subscribers)
+                    job.ever_subscribed = True
+            self.jobs[base_filename] = job
+            self.cond.notify_all()
+        self._changed(job)
+        return job, True
+
+    def run(self, job, target, **kwargs):
+        """
+        等待槽位后调用 target(job=job, **kwargs)，结束后释放槽位并记录最终状态。
+        target 返回 None 时，根据是否请求过取消记为已取消或失败。
+        """
+        result = None
+        try:
+            if self._acquire(job):
+                result = target(job=job, **kwargs)
+        finally:
+            with self.cond:
+                self.running.discard(job)
+                if result is not None:
+                    job.state = STATE_COMPLETED
+                else:
+                    job.state = STATE_CANCELLED if job.cancel_requested else STATE_FAILED
+                job.finished_at = time.time()
+                self.cond.notify_all()
+            self._changed(job)
+        return result
+
+    def checkpoint(self, job):
+        with self.cond:
+            self._check_idle(job)
+            if job.cancel_requested:
+                return False
+            if not job.pause_requested and not self._preempted_by(job):
+                return True
+            # 暂停或被更高优先级的任务抢占：让出槽位，之后重新排队等待
+            self.running.discard(job)
+            job.state = STATE_PAUSED if job.pause_requested else STATE_QUEUED
+            self.cond.notify_all()
+        print(f"任务 '{job.base_filename}' 在分块边界{'暂停' if job.state == STATE_PAUSED else '让出槽位'}。")
+        self._changed(job)
+        return self._acquire(job)
+
+    def _acquire(self, job):
+        changed = False
+        try:
+            with self.cond:
+                while True:
+                    changed = self._check_idle(job) or changed
+                    if job.cancel_requested:
+                        return False
+                    if job.pause_requested:
+                        if job.state != STATE_PAUSED:
+                            job.state = STATE_PAUSED
+                            changed = True
+                    else:
+                        if job.state == STATE_PAUSED:
+                            job.state = STATE_QUEUED
+                            changed = True
+                        if (len(self.running) < self.max_running and self._next_waiting() is job
+                                and not self._yields_to_external(job)):
+                            self.running.add(job)
+                            job.state = STATE_RUNNING
+                            job.started_at = job.started_at or time.time()
+                            changed = True
+                            return True
+                    if changed:
+                        # 在等待前通知状态变化，避免持锁调用回调
+                        self.cond.release()
+                        try:
+                            self._changed(job)
+                        finally:
+                            self.cond.acquire()
+                        changed = False
+                    self.cond.wait(timeout=1.0)
+        finally:
+            if changed:
+                self._changed(job)
+
+    def _next_waiting(self):
+        waiting = [j for j in self.jobs.values()
+                   if j.state == STATE_QUEUED and not j.pause_requested and not j.cancel_requested]
+        if not waiting:
+            return None
+        return max(waiting, key=lambda j: (j.priority, -j.seq))
+
+    def _preempted_by(self, job):
+        if self._yields_to_external(job):
+            return True
+        waiting = self._next_waiting()
+        return waiting is not None and waiting.priority > job.priority and len(self.running) >= self.max_running
+
+    def _yields_to_external(self, job):
+        return self.external_priority is not None and self.external_priority > job.priority
+
+    def _check_idle(self, job):
+        """交互式任务在所有订阅者断开超过 idle_cancel_seconds 后自动取消。从未被订阅的任务不会自动取消。"""
+        if job.cancel_requested or not job.interactive or not job.ever_subscribed or job.subscribers:
+            return False
+        if self.idle_cancel_seconds is None or time.time() - job.unsubscribed_at < self.idle_cancel_seconds:
+            return False
+        job.cancel_requested = True
+        job.cancel_reason = 'idle'
+        print(f"任务 '{job.base_filename}' 已 {self.idle_cancel_seconds} 秒没有订阅者，自动取消。")
+        self.cond.notify_all()
+        return True
+
+    # --- 任务控制 ---
+
+    def get(self, base_filename):
+        with self.cond:
+            return self.jobs.get(base_filename)
+
+    def list_jobs(self):
+        with self.cond:
+            jobs = sorted(self.jobs.values(), key=lambda j: (-j.priority, j.seq))
+            return [job.as_dict() for job in jobs]
+
+    def _control(self, base_filename, action):
+        with self.cond:
+            job = self.jobs.get(base_filename)
+            if job is None or job.state in FINISHED_STATES:
+                return job
+            action(job)
+            self.cond.notify_all()
+        self._changed(job)
+        return job
+
+    def cancel(self, base_filename, reason='user'):
+        def action(job):
+            job.cancel_requested = True
+            job.cancel_reason = reason
+        return self._control(base_filename, action)
+
+    def pause(self, base_filename):
+        def action(job):
+            job.pause_requested = True
+        return self._control(base_filename, action)
+
+    def resume(self, base_filename):
+        def action(job):
+            job.pause_requested = False
+        return self._control(base_filename, action)
+
+    def set_priority(self, base_filename, priority):
+        def action(job):
+            job.priority = int(priority)
+        return self._control(base_filename, action)
+
+    # --- 订阅 (Socket.IO 客户端) ---
+
+    def subscribe(self, sid, base_filename):
+        with self.cond:
+            job = self.jobs.get(base_filename)
+            if job is None:
+                return None
+            job.subscribers.add(sid)
+            job.ever_subscribed = True
+            self.cond.notify_all()
+        return job
+
+    def unsubscribe(self, sid, base_filename=None):
+        """取消订阅；未指定文件名时 (例如客户端断开) 取消该客户端的所有订阅。"""
+        with self.cond:
+            for job in self.jobs.values():
+                if (base_filename is None or job.base_filename == base_filename) and sid in job.subscribers:
+                    job.subscribers.discard(sid)
+                    if not job.subscribers:
+                        job.unsubscribed_at = time.time()
+            self.cond.notify_all()
+
+    def _changed(self, job):
+        if self.on_change:
+            try:
+                self.on_change(job)
+            except Exception as e:
+                print(f"通知任务状态变化时出错: {e}")
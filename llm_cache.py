@@ -0,0 +1,229 @@
+import json
+import hashlib
+import datetime
+from storage import data_path, connect_db
+
+# --- 配置 ---
+DEFAULT_CACHE_PATH = data_path('llm_cache.db')
+# 缓存内容的默认总大小上限 (512 MiB)
+DEFAULT_MAX_CACHE_BYTES = 512 * 1024 ** 2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    video TEXT NOT NULL,
+    model TEXT NOT NULL,
+    prompt_hash TEXT NOT NULL,
+    transcript_hash TEXT NOT NULL,
+    params TEXT NOT NULL,
+    summary_json TEXT NOT NULL,
+    block_map TEXT,
+    markdown TEXT NOT NULL,
+    stats TEXT,
+    size INTEGER NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL,
+    last_used_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_video ON entries (video);
+CREATE INDEX IF NOT EXISTS entries_last_used_at ON entries (last_used_at);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+-- 缓存键不含视频名，字幕相同的多个视频共享同一条目；这里记录每个条目服务过的所有视频
+CREATE TABLE IF NOT EXISTS entry_videos (
+    key TEXT NOT NULL,
+    video TEXT NOT NULL,
+    last_used_at TEXT NOT NULL,
+    PRIMARY KEY (key, video)
+);
+CREATE INDEX IF NOT EXISTS entry_videos_video ON entry_videos (video);
+"""
+
+# 数据库结构版本 (PRAGMA user_version)。迁移只在版本低于此值时执行一次，
+# 之后的连接不再写数据库，只读操作不会等待其他进程的写事务
+SCHEMA_VERSION = 1
+
+def _now():
+    return datetime.datetime.now().isoformat(timespec='microseconds')
+
+def _sha256(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def connect(cache_path=DEFAULT_CACHE_PATH):
+    # auto_vacuum 只能在建表前设置，之后淘汰条目时可以通过 incremental_vacuum 归还磁盘空间
+    conn = connect_db(cache_path, _SCHEMA, pragmas=('auto_vacuum=INCREMENTAL',))
+    if conn.execute('PRAGMA user_version').fetchone()[0] < SCHEMA_VERSION:
+        _migrate(conn)
+    return conn
+
+def _migrate(conn):
+    with conn:
+        # 版本 1：旧版本数据库根据 entries.video 补充 entry_videos 关联记录
+        conn.execute('INSERT OR IGNORE INTO entry_videos (key, video, last_used_at) '
+                     'SELECT key, video, last_used_at FROM entries')
+        conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+def normalize_transcript(segments):
+    """将字幕段规范化为稳定的文本 (时间戳 + 去除多余空白的字幕)，只有实际内容变化才会改变哈希。"""
+    return "\n".join(
+        f"{segment['start']}|{segment['end']}|{' '.join(segment['text'].split())}" for segment in segments
+    )
+
+def make_cache_key(segments, prompt_template, model, params):
+    """
+    根据 (规范化字幕, Prompt 模板, 模型, 请求参数) 计算缓存键。
+    返回 (cache_key, transcript_hash, prompt_hash)。
+    """
+    transcript_hash = _sha256(normalize_transcript(segments))
+    prompt_hash = _sha256(prompt_template)
+    key_material = json.dumps({
+        'transcript': transcript_hash,
+        'prompt': prompt_hash,
+        'model': model,
+        'params': params
+    }, sort_keys=True, ensure_ascii=False)
+    return _sha256(key_material), transcript_hash, prompt_hash
+
+def _bump(conn, name):
+    conn.execute('INSERT INTO counters (name, value) VALUES (?, 1) '
+                 'ON CONFLICT (name) DO UPDATE SET value = value + 1', (name,))
+
+def _link_video(conn, key, video, now):
+    conn.execute('INSERT INTO entry_videos (key, video, last_used_at) VALUES (?, ?, ?) '
+                 'ON CONFLICT (key, video) DO UPDATE SET last_used_at = excluded.last_used_at', (key, video, now))
+
+def _decode(row):
+    entry = dict(row)
+    entry['params'] = json.loads(entry['params'])
+    entry['block_map'] = json.loads(entry['block_map']) if entry['block_map'] else None
+    entry['stats'] = json.loads(entry['stats']) if entry['stats'] else None
+    return entry
+
+def get(key, video=None, coalesced=False, cache_path=DEFAULT_CACHE_PATH):
+    """
+    查询缓存。命中时更新最近使用时间、记录条目与 video 的关联并返回条目，未命中返回 None。
+    两种情况都会计入统计；coalesced 为 True 表示调用方等待同一键的生成完成后再次查询，
+    此时命中计为 coalesced，未命中不计数 (首次查询已计为未命中)。
+    """
+    conn = connect(cache_path)
+    try:
+        with conn:
+            row = conn.execute('SELECT * FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                if not coalesced:
+                    _bump(conn, 'misses')
+                return None
+            now = _now()
+            conn.execute('UPDATE entries SET hits = hits + 1, last_used_at = ? WHERE key = ?', (now, key))
+            if video is not None:
+                _link_video(conn, key, video, now)
+            _bump(conn, 'coalesced' if coalesced else 'hits')
+        entry = _decode(row)
+        entry['hits'] += 1
+        return entry
+    finally:
+        conn.close()
+
+def put(key, video, model, transcript_hash, prompt_hash, params, summary_json, block_map, markdown, stats=None,
+        max_bytes=DEFAULT_MAX_CACHE_BYTES, cache_path=DEFAULT_CACHE_PATH):
+    """写入 (或覆盖) 一个缓存条目，随后按 LRU 淘汰超出 max_bytes 的旧条目。返回写入的条目。"""
+    block_map_json = json.dumps(block_map) if block_map is not None else None
+    stats_json = json.dumps(stats, ensure_ascii=False) if stats is not None else None
+    size = sum(len(value.encode('utf-8')) for value in (summary_json, markdown, block_map_json or '', stats_json or ''))
+    now = _now()
+    conn = connect(cache_path)
+    try:
+        with conn:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO entries (key, video, model, prompt_hash, transcript_hash, params,
+                    summary_json, block_map, markdown, stats, size, hits, created_at, last_used_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0, ?, ?)
+                """,
+                (key, video, model, prompt_hash, transcript_hash, json.dumps(params, sort_keys=True, ensure_ascii=False),
+                 summary_json, block_map_json, markdown, stats_json, size, now, now)
+            )
+            _link_video(conn, key, video, now)
+        _evict(conn, max_bytes, keep=key)
+        row = conn.execute('SELECT * FROM entries WHERE key = ?', (key,)).fetchone()
+        return _decode(row)
+    finally:
+        conn.close()
+
+def _evict(conn, max_bytes, keep=None):
+    if max_bytes is None:
+        return 0
+    total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+    if total <= max_bytes:
+        return 0
+    evicted = 0
+    with conn:
+        for row in conn.execute('SELECT key, video, size FROM entries ORDER BY last_used_at').fetchall():
+            if total <= max_bytes:
+                break
+            if row['key'] == keep:
+                continue
+            conn.execute('DELETE FROM entries WHERE key = ?', (row['key'],))
+            conn.execute('DELETE FROM entry_videos WHERE key = ?', (row['key'],))
+            total -= row['size']
+            evicted += 1
+            _bump(conn, 'evictions')
+            print(f"LLM 结果缓存超出上限，已淘汰 '{row['video']}' 的条目 {row['key'][:12]}")
+    conn.execute('PRAGMA incremental_vacuum').fetchall()
+    return evicted
+
+def evict(max_bytes=DEFAULT_MAX_CACHE_BYTES, cache_path=DEFAULT_CACHE_PATH):
+    """按最近使用时间淘汰条目，直到总大小不超过 max_bytes。返回淘汰的条目数。"""
+    conn = connect(cache_path)
+    try:
+        return _evict(conn, max_bytes)
+    finally:
+        conn.close()
+
+def list_variants(video, cache_path=DEFAULT_CACHE_PATH):
+    """
+    列出一个视频使用过的所有缓存变体 (不同模型/Prompt/参数/字幕版本)，不含摘要正文。
+    与其他视频共享的条目也会列出；last_used_at 是该视频最近一次使用的时间。
+    """
+    conn = connect(cache_path)
+    try:
+        rows = conn.execute(
+            """
+            SELECT e.key, e.model, e.prompt_hash, e.transcript_hash, e.params, e.size, e.hits, e.created_at,
+                ev.last_used_at
+            FROM entry_videos ev JOIN entries e ON e.key = ev.key
+            WHERE ev.video = ? ORDER BY ev.last_used_at DESC
+            """,
+            (video,)
+        ).fetchall()
+    finally:
+        conn.close()
+    variants = []
+    for row in rows:
+        variant = dict(row)
+        variant['params'] = json.loads(variant['params'])
+        variants.append(variant)
+    return variants
+
+def cache_stats(max_bytes=DEFAULT_MAX_CACHE_BYTES, cache_path=DEFAULT_CACHE_PATH):
+    """返回命中/未命中/合并等待/淘汰次数、条目数和占用大小。"""
+    conn = connect(cache_path)
+    try:
+        counters = {row['name']: row['value'] for row in conn.execute('SELECT name, value FROM counters')}
+        entries, total = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+    finally:
+        conn.close()
+    hits = counters.get('hits', 0)
+    misses = counters.get('misses', 0)
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / (hits + misses), 4) if hits + misses else 0.0,
+        'coalesced': counters.get('coalesced', 0),
+        'evictions': counters.get('evictions', 0),
+        'entries': entries,
+        'bytes': total,
+        'max_bytes': max_bytes
+    }
@@ -0,0 +1,497 @@
+import os
+import sys
+import json
+import math
+import time
+import wave
+import zlib
+import uuid
+import types
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import numpy as np
+import requests
+import socketio
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# --- 默认配置 ---
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_RATE = 16000
+STUB_MODEL = 'stub-model'
+
+# 报告中各阶段的顺序：连接、预检查、上传、首条字幕、转写完成、摘要、整个会话
+PHASES = ('connect', 'pre_upload', 'upload', 'first_subtitle', 'transcription', 'summary', 'session')
+
+# 客户端记录事件延迟的 Socket.IO 事件
+STREAM_EVENTS = ('new_subtitle_chunk', 'transcription_complete', 'transcription_error',
+                 'transcription_cancelled', 'job_status')
+
+# ---------------------------------------------------------------------------
+# 桩服务器：在子进程中导入 main，用本地桩替换 Whisper 模型和 OpenAI 客户端
+# ---------------------------------------------------------------------------
+
+def load_wav(path):
+    """用标准库读取 16 kHz 单声道 16 位 WAV，代替 whisper.load_audio (桩服务器不依赖 ffmpeg)。"""
+    with wave.open(path, 'rb') as f:
+        if f.getnchannels() != 1 or f.getsampwidth() != 2 or f.getframerate() != SAMPLE_RATE:
+            raise ValueError(f"桩服务器只支持 {SAMPLE_RATE} Hz 单声道 16 位 WAV: '{path}'")
+        frames = f.readframes(f.getnframes())
+    return np.frombuffer(frames, dtype=np.int16).astype(np.float32) / 32768.0
+
+class StubWhisperModel:
+    """
+    模拟 Whisper 模型：每个分块休眠 chunk_delay 秒 (加上随机抖动)，返回均匀分布的字幕段。
+    字幕文本包含分块内容的校验值，不同音频得到不同的字幕，摘要请求不会全部命中缓存。
+    """
+
+    def __init__(self, chunk_delay, segments_per_chunk, jitter=0.0):
+        self.chunk_delay = chunk_delay
+        self.segments_per_chunk = segments_per_chunk
+        self.jitter = jitter
+
+    def transcribe(self, audio, verbose=None):
+        time.sleep(max(self.chunk_delay + np.random.uniform(-self.jitter, self.jitter), 0))
+        duration = len(audio) / SAMPLE_RATE
+        tag = f"{zlib.crc32(np.ascontiguousarray(audio).tobytes()):08x}"
+        step = duration / self.segments_per_chunk
+        segments = []
+        for k in range(self.segments_per_chunk):
+            segments.append({
+                'start': k * step,
+                'end': (k + 1) * step,
+                'text': f"压测字幕 {tag} 第 {k + 1} 句，用于模拟 Whisper 的输出。"
+            })
+        return {'segments': segments}
+
+class StubOpenAIClient:
+    """模拟 OpenAI 客户端：chat.completions.create 休眠 delay 秒后返回固定结构的 JSON 摘要。"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self._create))
+
+    def _create(self, model, messages, **kwargs):
+        time.sleep(self.delay)
+        content = json.dumps({'summary': [{
+            'title': '压测摘要',
+            'description': f"由桩客户端生成 ({model})",
+            'index': 0,
+            'children': [{'title': '第一部分', 'description': '桩节点', 'index': 0}]
+        }]}, ensure_ascii=False)
+        message = types.SimpleNamespace(content=content)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+def serve_stub(args):
+    """
+    以桩模式启动 main.py 中的 Flask-SocketIO 服务。HTTP 路由、Socket.IO、任务调度、目录和缓存都是真实代码，
+    只替换模型、OpenAI 客户端和音频解码。每个事件负载都附加 server_ts，供客户端计算投递延迟。
+    """
+    import whisper
+    import main
+
+    whisper.load_audio = load_wav
+    main.WHISPER_MODEL = StubWhisperModel(args.chunk_delay, args.segments_per_chunk, args.chunk_jitter)
+    main.OPENAI_CLIENT = StubOpenAIClient(args.summary_delay)
+    main.APP_CONFIG = {'openai': {'model': STUB_MODEL}}
+    with open(os.path.join(REPO_DIR, 'prompt_summary.txt'), 'r', encoding='utf-8') as f:
+        main.PROMPT_TEMPLATE = f.read()
+    main.job_manager.configure(max_running=args.max_concurrent, idle_cancel_seconds=args.idle_cancel_seconds)
+
+    original_emit = main.socketio.emit
+
+    def emit_with_timestamp(event, *emit_args, **kwargs):
+        if emit_args and isinstance(emit_args[0], dict):
+            emit_args = (dict(emit_args[0], server_ts=time.time()),) + emit_args[1:]
+        return original_emit(event, *emit_args, **kwargs)
+
+    main.socketio.emit = emit_with_timestamp
+
+    print(f"桩服务器：监听 http://127.0.0.1:{args.port} (工作目录 '{os.getcwd()}')")
+    main.socketio.run(main.app, host='127.0.0.1', port=args.port, allow_unsafe_werkzeug=True)
+
+# ---------------------------------------------------------------------------
+# 压测客户端
+# ---------------------------------------------------------------------------
+
+def write_test_wav(path, seconds, seed):
+    """生成低幅度噪声 WAV。seed 相同的文件内容相同，可用于测试摘要缓存命中。"""
+    samples = np.random.default_rng(seed).integers(-64, 64, int(seconds * SAMPLE_RATE), dtype=np.int16)
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(samples.tobytes())
+
+def percentile(values, p):
+    """最近秩法计算百分位数。"""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+def read_rss_bytes(pid):
+    """读取进程的常驻内存 (RSS)。优先使用 psutil，否则读取 /proc/<pid>/status。"""
+    try:
+        if psutil is not None:
+            return psutil.Process(pid).memory_info().rss
+        with open(f"/proc/{pid}/status", 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except Exception:
+        pass
+    return None
+
+class Recorder:
+    """线程安全地汇总所有会话的阶段耗时、事件延迟、错误和服务器内存采样。"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.phases = {phase: [] for phase in PHASES}
+        self.event_lags = []
+        self.event_counts = {}
+        self.completed = 0
+        self.failed = 0
+        self.summary_cache_hits = 0
+        self.errors = {}
+        self.memory = []
+        self.last_finished_at = None
+
+    def phase(self, name, seconds):
+        with self.lock:
+            self.phases[name].append(seconds)
+
+    def event(self, name, lag):
+        with self.lock:
+            self.event_counts[name] = self.event_counts.get(name, 0) + 1
+            if lag is not None:
+                self.event_lags.append(lag)
+
+    def finish(self, finished_at, error=None, summary_cache_hit=False):
+        with self.lock:
+            self.last_finished_at = max(self.last_finished_at or finished_at, finished_at)
+            if error is None:
+                self.completed += 1
+                self.summary_cache_hits += int(summary_cache_hit)
+            else:
+                self.failed += 1
+                self.errors[error] = self.errors.get(error, 0) + 1
+
+    def sample_memory(self, rss):
+        with self.lock:
+            self.memory.append(rss)
+
+def phase_summary(values):
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'p50_ms': round(percentile(values, 50) * 1000, 1),
+        'p95_ms': round(percentile(values, 95) * 1000, 1),
+        'p99_ms': round(percentile(values, 99) * 1000, 1),
+        'max_ms': round(max(values) * 1000, 1)
+    }
+
+class LoadTest:
+    """
+    模拟 N 个并发浏览器会话。每个会话的流程与前端一致：
+    连接 Socket.IO -> /pre-upload -> /upload (附带 sid 订阅任务) -> 等待 new_subtitle_chunk / transcription_complete -> /summary。
+    """
+
+    def __init__(self, url, sessions, audio_seconds, ramp_up, timeout, same_audio, transports, workdir,
+                 server_pid=None, memory_interval=0.5):
+        self.url = url.rstrip('/')
+        self.sessions = sessions
+        self.audio_seconds = audio_seconds
+        self.ramp_up = ramp_up
+        self.timeout = timeout
+        self.same_audio = same_audio
+        self.transports = transports
+        self.workdir = workdir
+        self.server_pid = server_pid
+        self.memory_interval = memory_interval
+        self.run_id = uuid.uuid4().hex[:8]
+        self.recorder = Recorder()
+        self.stop_event = threading.Event()
+
+    def prepare_media(self):
+        """为每个会话生成上传用的 WAV 文件 (不计入压测耗时)。"""
+        media_dir = os.path.join(self.workdir, 'media')
+        os.makedirs(media_dir, exist_ok=True)
+        paths = []
+        for i in range(self.sessions):
+            path = os.path.join(media_dir, f"lt-{self.run_id}-{i:03d}.wav")
+            write_test_wav(path, self.audio_seconds, 0 if self.same_audio else i + 1)
+            paths.append(path)
+        return paths
+
+    def run_session(self, media_path):
+        recorder = self.recorder
+        filename = os.path.basename(media_path)
+        base_filename = os.path.splitext(filename)[0]
+        http = requests.Session()
+        sio = socketio.Client(reconnection=False)
+        done = threading.Event()
+        outcome = {}
+
+        def make_handler(event):
+            def handler(data=None):
+                received = time.time()
+                data = data if isinstance(data, dict) else {}
+                lag = received - data['server_ts'] if 'server_ts' in data else None
+                recorder.event(event, lag)
+                # 事件对所有客户端广播，只有自己的文件才影响会话流程
+                if data.get('filename') != base_filename:
+                    return
+                if event == 'new_subtitle_chunk' and data.get('segments'):
+                    outcome.setdefault('first_subtitle_at', received)
+                elif event in ('transcription_complete', 'transcription_error', 'transcription_cancelled'):
+                    outcome.setdefault('finished_event', event)
+                    outcome.setdefault('finished_at', received)
+                    done.set()
+            return handler
+
+        for event in STREAM_EVENTS:
+            sio.on(event, make_handler(event))
+
+        session_started = time.time()
+        error = None
+        summary_cache_hit = False
+        try:
+            started = time.time()
+            sio.connect(self.url, transports=self.transports, wait_timeout=self.timeout)
+            recorder.phase('connect', time.time() - started)
+
+            started = time.time()
+            response = http.post(f"{self.url}/pre-upload", json={'filename': filename}, timeout=self.timeout)
+            recorder.phase('pre_upload', time.time() - started)
+            if response.status_code != 204:
+                raise RuntimeError(f"/pre-upload 返回 {response.status_code}")
+
+            upload_started = time.time()
+            with open(media_path, 'rb') as f:
+                response = http.post(f"{self.url}/upload", files={'file': (filename, f, 'audio/wav')},
+                                     data={'sid': sio.get_sid()}, timeout=self.timeout)
+            recorder.phase('upload', time.time() - upload_started)
+            if response.status_code != 202:
+                raise RuntimeError(f"/upload 返回 {response.status_code}")
+
+            if not done.wait(self.timeout):
+                raise RuntimeError("等待 transcription_complete 超时")
+            if 'first_subtitle_at' in outcome:
+                recorder.phase('first_subtitle', outcome['first_subtitle_at'] - upload_started)
+            if outcome['finished_event'] != 'transcription_complete':
+                raise RuntimeError(f"转写未完成: {outcome['finished_event']}")
+            recorder.phase('transcription', outcome['finished_at'] - upload_started)
+
+            started = time.time()
+            response = http.post(f"{self.url}/summary", json={'filename': filename}, timeout=self.timeout)
+            recorder.phase('summary', time.time() - started)
+            if response.status_code != 200:
+                raise RuntimeError(f"/summary 返回 {response.status_code}")
+            summary_cache_hit = response.json().get('cache', {}).get('hit', False)
+
+            recorder.phase('session', time.time() - session_started)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        finally:
+            finished_at = time.time()
+            try:
+                sio.disconnect()
+            except Exception:
+                pass
+            http.close()
+        recorder.finish(finished_at, error, summary_cache_hit)
+
+    def monitor_memory(self):
+        while not self.stop_event.is_set():
+            rss = read_rss_bytes(self.server_pid)
+            if rss is not None:
+                self.recorder.sample_memory(rss)
+            self.stop_event.wait(self.memory_interval)
+
+    def run(self):
+        media_paths = self.prepare_media()
+        monitor = None
+        if self.server_pid:
+            monitor = threading.Thread(target=self.monitor_memory, daemon=True)
+            monitor.start()
+
+        print(f"开始压测: {self.sessions} 个会话, 每个音频 {self.audio_seconds} 秒, 预热 {self.ramp_up} 秒。")
+        started = time.time()
+        threads = []
+        for i, media_path in enumerate(media_paths):
+            thread = threading.Thread(target=self.run_session, args=(media_path,), daemon=True)
+            thread.start()
+            threads.append(thread)
+            if self.ramp_up and i < len(media_paths) - 1:
+                time.sleep(self.ramp_up / len(media_paths))
+        for thread in threads:
+            thread.join()
+        # 以最后一个会话结束 (断开连接之前) 的时间计算吞吐量，不计客户端关闭连接的耗时
+        elapsed = (self.recorder.last_finished_at or time.time()) - started
+
+        self.stop_event.set()
+        if monitor:
+            monitor.join()
+        return self.build_report(elapsed)
+
+    def build_report(self, elapsed):
+        recorder = self.recorder
+        report = {
+            'sessions': self.sessions,
+            'completed': recorder.completed,
+            'failed': recorder.failed,
+            'elapsed_seconds': round(elapsed, 2),
+            'throughput_sessions_per_second': round(recorder.completed / elapsed, 3) if elapsed else 0.0,
+            'summary_cache_hits': recorder.summary_cache_hits,
+            'phases': {phase: phase_summary(recorder.phases[phase]) for phase in PHASES},
+            'events': dict(phase_summary(recorder.event_lags), received=recorder.event_counts),
+            'errors': recorder.errors
+        }
+        if recorder.memory:
+            report['server_memory'] = {
+                'start_bytes': recorder.memory[0],
+                'peak_bytes': max(recorder.memory),
+                'end_bytes': recorder.memory[-1]
+            }
+        try:
+            report['llm_cache'] = requests.get(f"{self.url}/cache/stats", timeout=10).json()
+        except Exception as e:
+            print(f"获取 /cache/stats 失败: {e}")
+        return report
+
+def print_report(report):
+    mib = 1024 ** 2
+    print("\n=== 压测结果 ===")
+    print(f"会话: {report['sessions']} (成功 {report['completed']}, 失败 {report['failed']}), "
+          f"总耗时 {report['elapsed_seconds']} 秒, 吞吐量 {report['throughput_sessions_per_second']} 会话/秒, "
+          f"摘要缓存命中 {report['summary_cache_hits']} 次")
+    print(f"\n{'阶段':<16}{'次数':>8}{'p50(ms)':>12}{'p95(ms)':>12}{'p99(ms)':>12}{'max(ms)':>12}")
+    for name, stats in list(report['phases'].items()) + [('event_lag', report['events'])]:
+        if not stats['count']:
+            print(f"{name:<16}{0:>8}")
+            continue
+        print(f"{name:<16}{stats['count']:>8}{stats['p50_ms']:>12}{stats['p95_ms']:>12}"
+              f"{stats['p99_ms']:>12}{stats['max_ms']:>12}")
+    print("\n收到的事件: " + ", ".join(f"{name} {count}" for name, count in sorted(report['events']['received'].items())))
+    if 'server_memory' in report:
+        memory = report['server_memory']
+        print(f"服务器内存 (RSS): 开始 {memory['start_bytes'] / mib:.1f} MiB, "
+              f"峰值 {memory['peak_bytes'] / mib:.1f} MiB, 结束 {memory['end_bytes'] / mib:.1f} MiB")
+    if report['errors']:
+        print("\n错误:")
+        for error, count in sorted(report['errors'].items(), key=lambda item: -item[1]):
+            print(f"  {count} x {error}")
+
+def find_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_stub_server(args, workdir):
+    """在独立工作目录中启动桩服务器子进程 (data/ 与正式数据隔离)，等待 /status 就绪后返回 (进程, URL)。"""
+    port = args.port or find_free_port()
+    command = [
+        sys.executable, os.path.abspath(__file__), '--serve-stub', '--port', str(port),
+        '--chunk-delay', str(args.chunk_delay), '--chunk-jitter', str(args.chunk_jitter),
+        '--segments-per-chunk', str(args.segments_per_chunk), '--summary-delay', str(args.summary_delay),
+        '--max-concurrent', str(args.max_concurrent), '--idle-cancel-seconds', str(args.idle_cancel_seconds)
+    ]
+    log_path = os.path.join(workdir, 'server.log')
+    log_file = open(log_path, 'w', encoding='utf-8')
+    env = dict(os.environ, PYTHONUNBUFFERED='1', PYTHONIOENCODING='utf-8')
+    process = subprocess.Popen(command, cwd=workdir, stdout=log_file, stderr=subprocess.STDOUT, env=env)
+    log_file.close()
+    print(f"桩服务器已启动 (pid {process.pid})，日志: '{log_path}'")
+
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + args.startup_timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"桩服务器启动失败 (退出码 {process.returncode})，请查看 '{log_path}'")
+        try:
+            if requests.get(f"{url}/status", timeout=2).status_code == 200:
+                return process, url
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"桩服务器在 {args.startup_timeout} 秒内未就绪，请查看 '{log_path}'")
+
+def main():
+    """
+    主函数，启动桩服务器 (或连接已有服务器) 并运行并发会话压测。
+    """
+    parser = argparse.ArgumentParser(description="模拟多个并发浏览器会话，对 HTTP 与 Socket.IO 层进行端到端压测。")
+    parser.add_argument('--sessions', type=int, default=50, help="并发会话数 (默认: 50)")
+    parser.add_argument('--audio-seconds', type=float, default=60, help="每个上传音频的时长秒数 (默认: 60)")
+    parser.add_argument('--ramp-up', type=float, default=0, help="在多少秒内逐步启动所有会话 (默认: 0，同时启动)")
+    parser.add_argument('--timeout', type=float, default=600, help="单个会话各步骤的超时秒数 (默认: 600)")
+    parser.add_argument('--same-audio', action='store_true', help="所有会话上传相同内容的音频 (测试摘要缓存命中)")
+    parser.add_argument('--transport', choices=('websocket', 'polling'),
+                        help="Socket.IO 传输方式 (默认: 与浏览器相同，先轮询再升级)")
+    parser.add_argument('--url', help="压测已运行的服务器，而不是启动桩服务器 (此时不使用下面的桩参数)")
+    parser.add_argument('--server-pid', type=int, help="与 --url 一起使用时，采样该进程的内存")
+    parser.add_argument('--workdir', help="桩服务器的工作目录 (默认: 新建临时目录)")
+    parser.add_argument('--report', help="将结果写入 JSON 文件，便于在不同版本之间比较")
+    parser.add_argument('--port', type=int, help="桩服务器端口 (默认: 随机空闲端口)")
+    parser.add_argument('--startup-timeout', type=float, default=120, help="等待桩服务器就绪的秒数 (默认: 120)")
+    parser.add_argument('--chunk-delay', type=float, default=0.2, help="桩 Whisper 每个 30 秒分块的耗时 (默认: 0.2)")
+    parser.add_argument('--chunk-jitter', type=float, default=0.0, help="桩 Whisper 分块耗时的随机抖动秒数 (默认: 0)")
+    parser.add_argument('--segments-per-chunk', type=int, default=10, help="桩 Whisper 每个分块返回的字幕段数 (默认: 10)")
+    parser.add_argument('--summary-delay', type=float, default=1.0, help="桩 OpenAI 每次摘要请求的耗时 (默认: 1.0)")
+    parser.add_argument('--max-concurrent', type=int, default=1, help="同时运行的转写任务数 (默认: 1，与 config.json 一致)")
+    parser.add_argument('--idle-cancel-seconds', type=float, default=300, help="无订阅者自动取消的秒数 (默认: 300)")
+    parser.add_argument('--serve-stub', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_stub:
+        serve_stub(args)
+        return
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='ai-video-summary-load-')
+    os.makedirs(workdir, exist_ok=True)
+    process = None
+    url, server_pid = args.url, args.server_pid
+    if not url:
+        process, url = start_stub_server(args, workdir)
+        server_pid = process.pid
+
+    try:
+        load_test = LoadTest(
+            url=url,
+            sessions=max(args.sessions, 1),
+            audio_seconds=args.audio_seconds,
+            ramp_up=args.ramp_up,
+            timeout=args.timeout,
+            same_audio=args.same_audio,
+            transports=[args.transport] if args.transport else None,
+            workdir=workdir,
+            server_pid=server_pid
+        )
+        report = load_test.run()
+    finally:
+        if process:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    print_report(report)
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入: '{args.report}'")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,33 +2,55 @@ from flask import Flask, request, jsonify, send_from_directory
 from flask_cors import CORS
 from flask_socketio import SocketIO
 import os
-from werkzeug.utils import secure_filename
+import shutil
 import datetime
 import threading
 import json
 import re
 import time
 import marko
-from transcription import load_whisper_model, transcribe_audio
+from transcription import load_whisper_model, transcribe_audio, ALLOWED_EXTENSIONS
 from openai_client import get_openai_client
+import catalog
+import llm_cache
+import jobs
+from summarizer import cached_summary, generate_cached_summary, write_summary_artifacts
+from transcript_compaction import compaction_options
+from pcm_cache import DEFAULT_MAX_CACHE_BYTES
+from storage import DATA_FOLDER, safe_filename
+from search_index import sync_index, search
 from vtt_utils import parse_vtt_to_segments
-from vtt_parser import parse_vtt_to_custom_format
 
 # --- 全局变量 ---
 WHISPER_MODEL = None
 OPENAI_CLIENT = None
 APP_CONFIG = {}
 PROMPT_TEMPLATE = ""
+LLM_CACHE_MAX_BYTES = llm_cache.DEFAULT_MAX_CACHE_BYTES
 
 def load_dependencies():
     """加载所有依赖项：模型、配置、客户端等"""
-    global WHISPER_MODEL, OPENAI_CLIENT, APP_CONFIG, PROMPT_TEMPLATE
+    global WHISPER_MODEL, OPENAI_CLIENT, APP_CONFIG, PROMPT_TEMPLATE, LLM_CACHE_MAX_BYTES
+
+    # 为 data 目录中尚未登记的旧数据补充目录条目
+    print("后台线程：开始同步媒体目录...")
+    try:
+        added = catalog.sync_from_disk(DATA_FOLDER, ALLOWED_EXTENSIONS)
+        print(f"后台线程：媒体目录同步完成，新登记 {added} 个视频。")
+    except Exception as e:
+        print(f"后台线程：同步媒体目录失败: {e}")
 
     # 加载应用配置
     print("后台线程：开始加载 config.json...")
     try:
         with open('config.json', 'r', encoding='utf-8') as f:
             APP_CONFIG = json.load(f)
+        LLM_CACHE_MAX_BYTES = APP_CONFIG.get('llm_cache', {}).get('max_bytes', llm_cache.DEFAULT_MAX_CACHE_BYTES)
+        jobs_config = APP_CONFIG.get('jobs', {})
+        job_manager.configure(
+            max_running=jobs_config.get('max_concurrent', jobs.DEFAULT_MAX_RUNNING),
+            idle_cancel_seconds=jobs_config.get('idle_cancel_seconds', jobs.DEFAULT_IDLE_CANCEL_SECONDS)
+        )
         print("后台线程：config.json 加载成功。")
     except Exception as e:
         print(f"后台线程：加载 config.json 失败: {e}")
@@ -58,21 +80,41 @@ def load_dependencies():
         print(f"后台线程：初始化 OpenAI 客户端失败: {e}")
 
         
+    # 同步字幕检索索引
+    print("后台线程：开始同步字幕检索索引...")
+    try:
+        updated, removed = sync_index(DATA_FOLDER)
+        print(f"后台线程：检索索引同步完成，更新 {updated} 个视频，移除 {removed} 个视频。")
+    except Exception as e:
+        print(f"后台线程：同步检索索引失败: {e}")
+
     # 加载 Whisper 模型
     print("后台线程：开始加载 Whisper 模型...")
     WHISPER_MODEL = load_whisper_model("turbo") 
     if WHISPER_MODEL:
         print("后台线程：Whisper 模型加载完毕。")
+        resume_interrupted_jobs()
     else:
         print("后台线程：Whisper 模型加载失败。")
 
+def resume_interrupted_jobs():
+    """恢复上次进程退出时未完成的转写任务，已生成的分块会被直接复用"""
+    for media in catalog.find_interrupted():
+        if not os.path.exists(media['media_path']):
+            catalog.fail_transcription(media['base_filename'], "源文件不存在，无法恢复转写")
+            continue
+        print(f"后台线程：恢复中断的转写任务 '{media['base_filename']}' "
+              f"({media['chunks_done']}/{media['num_chunks'] or '?'} 块已完成)")
+        # 恢复的任务作为后台任务运行，新的交互式上传可以在分块边界抢占它们
+        start_transcription_task(media['media_path'], media['base_filename'], media['original_filename'],
+                                 priority=jobs.PRIORITY_BACKGROUND, interactive=False)
+
 app = Flask(__name__, static_folder='static', static_url_path='')
 CORS(app) # 同时为 HTTP 端点启用 CORS
 socketio = SocketIO(app, cors_allowed_origins="*")
 
-# --- 配置 ---
-DATA_FOLDER = 'data'
-ALLOWED_EXTENSIONS = {'mp4', 'mp3', 'wav'}
+# --- 转写任务控制：状态变化时广播 job_status 事件 ---
+job_manager = jobs.JobManager(on_change=lambda job: socketio.emit('job_status', job.as_dict()))
 
 # --- 确保根数据目录存在 ---
 os.makedirs(DATA_FOLDER, exist_ok=True)
@@ -82,6 +124,69 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def start_transcription_task(filepath, base_filename, original_filename,
+                             priority=jobs.PRIORITY_INTERACTIVE, interactive=True):
+    """登记转写任务并在后台线程中启动，任务会等待槽位后运行。同名任务正在进行时直接返回该任务。"""
+    job, created = job_manager.submit(base_filename, original_filename, filepath,
+                                      priority=priority, interactive=interactive)
+    if not created:
+        return job
+    pcm_cache_config = APP_CONFIG.get('pcm_cache', {})
+    socketio.start_background_task(
+        job_manager.run,
+        job,
+        transcribe_audio,
+        model=WHISPER_MODEL,
+        audio_file=filepath,
+        socketio=socketio,
+        base_filename=base_filename,
+        original_filename=original_filename, # 传递原始文件名
+        pcm_cache_dtype=pcm_cache_config.get('dtype', 'float32'),
+        pcm_cache_max_bytes=pcm_cache_config.get('max_bytes', DEFAULT_MAX_CACHE_BYTES)
+    )
+    return job
+
+def control_job(filename, action, priority=None):
+    """
+    执行任务控制操作 (cancel / pause / resume / priority)，返回 (响应内容, HTTP 状态码)。
+    对已取消或中断的任务执行 resume 会重新启动转写，并复用已完成的分块。
+    """
+    base_filename, _ = os.path.splitext(safe_filename(filename or ''))
+    if not base_filename:
+        return {"error": "请求中缺少文件名"}, 400
+
+    job = job_manager.get(base_filename)
+    active = job is not None and job.state not in jobs.FINISHED_STATES
+
+    if action == 'resume' and not active:
+        media = catalog.get_media(base_filename)
+        if not media or media['status'] == catalog.STATUS_TRANSCRIBED or not media['media_path'] \
+                or not os.path.exists(media['media_path']):
+            return {"error": "没有可以继续的转写任务"}, 404
+        if WHISPER_MODEL is None:
+            return {"error": "模型正在加载中，请稍后再试"}, 503
+        job = start_transcription_task(media['media_path'], base_filename, media['original_filename'],
+                                       priority=job.priority if job else jobs.PRIORITY_INTERACTIVE)
+        return job.as_dict(), 202
+
+    if not active:
+        return {"error": "找不到正在进行的转写任务"}, 404
+
+    if action == 'cancel':
+        job = job_manager.cancel(base_filename)
+    elif action == 'pause':
+        job = job_manager.pause(base_filename)
+    elif action == 'resume':
+        job = job_manager.resume(base_filename)
+    elif action == 'priority':
+        try:
+            job = job_manager.set_priority(base_filename, int(priority))
+        except (TypeError, ValueError):
+            return {"error": "priority 必须是整数"}, 400
+    else:
+        return {"error": f"未知的操作: {action}"}, 400
+    return job.as_dict(), 200
+
 def stream_existing_vtt(vtt_filepath, base_filename):
     """读取已有的 VTT 文件并分块通过 WebSocket 发送"""
     print(f"开始流式发送已存在的 VTT 文件: {vtt_filepath}")
@@ -121,14 +226,14 @@ def pre_upload_check():
     if not data or 'filename' not in data:
         return jsonify({"error": "请求中缺少文件名"}), 400
 
-    filename = secure_filename(data['filename'])
+    filename = safe_filename(data['filename'])
     print(f"[{datetime.datetime.now()}] Pre-upload check for: {filename}")
 
     base_filename, _ = os.path.splitext(filename)
-    video_folder = os.path.join(DATA_FOLDER, base_filename)
-    vtt_filepath = os.path.join(video_folder, f"{base_filename}.vtt")
+    media = catalog.get_media(base_filename)
 
-    if os.path.exists(vtt_filepath):
+    if media and media['status'] == catalog.STATUS_TRANSCRIBED and media['vtt_path']:
+        vtt_filepath = media['vtt_path']
         print(f"找到字幕文件: {vtt_filepath}, 直接通过 HTTP 响应发送。")
         try:
             with open(vtt_filepath, 'r', encoding='utf-8') as f:
@@ -141,7 +246,7 @@ def pre_upload_check():
         except Exception as e:
             return jsonify({"error": f"读取字幕文件时出错: {e}"}), 500
     else:
-        print(f"未找到字幕文件: {vtt_filepath}")
+        print(f"未找到字幕文件: {base_filename}")
         return jsonify({
             "message": "未找到字幕文件，请上传",
             "action": "proceed_upload"
@@ -152,6 +257,7 @@ def upload_file():
     """
     处理文件上传并自动触发后台转写。
     这个端点假设 pre-upload 检查已经完成，并且需要进行转写。
+    表单中的 sid (上传者的 Socket.IO 会话 ID) 会直接订阅该任务，断开后任务按配置自动取消。
     """
     if 'file' not in request.files:
         return jsonify({"error": "请求中没有文件部分"}), 400
@@ -167,8 +273,23 @@ def upload_file():
     if WHISPER_MODEL is None:
         return jsonify({"error": "模型正在加载中，请稍后再试"}), 503
 
-    filename = secure_filename(file.filename)
+    filename = safe_filename(file.filename)
     base_filename, _ = os.path.splitext(filename)
+
+    # 转写中的文件不能被覆盖，需先取消原任务
+    sid = request.form.get('sid')
+    existing_job = job_manager.get(base_filename)
+    if existing_job and existing_job.state not in jobs.FINISHED_STATES:
+        if existing_job.original_filename != file.filename:
+            return jsonify({"error": "该文件的转写任务正在进行中，请先取消", "job": existing_job.as_dict()}), 409
+        # 同一文件重复上传 (例如客户端断线重连)：不覆盖文件，改为用新的会话 ID 订阅进行中的任务
+        if sid:
+            job_manager.subscribe(sid, base_filename)
+        return jsonify({
+            "message": "该文件的转写任务已在进行中",
+            "filename": filename,
+            "job": existing_job.as_dict()
+        }), 200
     
     # --- 创建视频专属目录并保存文件 ---
     video_folder = os.path.join(DATA_FOLDER, base_filename)
@@ -177,132 +298,213 @@ def upload_file():
     
     try:
         file.save(filepath)
+        content_hash = catalog.file_sha256(filepath)
+        media = catalog.get_media(base_filename)
+        if media and media['content_hash'] and media['content_hash'] != content_hash:
+            # 同名文件的内容已变化：旧文件留下的分块不能复用，否则会被合并进新字幕
+            print(f"'{filename}' 的内容与上次上传不同，清除已完成的分块。")
+            shutil.rmtree(os.path.join(video_folder, 'tmp'), ignore_errors=True)
+        catalog.mark_uploaded(base_filename, file.filename, filepath, content_hash)
     except Exception as e:
         return jsonify({"error": f"保存文件时出错: {e}"}), 500
     
     print(f"为 '{filename}' 启动后台转写线程。")
-    socketio.start_background_task(
-        transcribe_audio,
-        model=WHISPER_MODEL,
-        audio_file=filepath,
-        socketio=socketio,
-        base_filename=base_filename,
-        original_filename=file.filename # 传递原始文件名
-    )
+    job = start_transcription_task(filepath, base_filename, file.filename)
+    if sid:
+        job_manager.subscribe(sid, base_filename)
 
     return jsonify({
         "message": "文件上传成功，转写任务已在后台启动",
-        "filename": filename
+        "filename": filename,
+        "job": job.as_dict()
     }), 202
 
 @app.route('/status', methods=['GET'])
 def status():
-    """检查模型加载状态"""
+    """检查模型加载状态，并返回各状态的媒体条目数"""
+    counts = catalog.count_by_status()
     if WHISPER_MODEL and OPENAI_CLIENT:
-        return jsonify({"status": "ready", "message": "所有服务已就绪"}), 200
+        return jsonify({"status": "ready", "message": "所有服务已就绪", "jobs": counts}), 200
     elif WHISPER_MODEL:
-        return jsonify({"status": "loading", "message": "OpenAI 客户端正在初始化..."}), 202
+        return jsonify({"status": "loading", "message": "OpenAI 客户端正在初始化...", "jobs": counts}), 202
     else:
-        return jsonify({"status": "loading", "message": "Whisper 模型正在加载中..."}), 202
+        return jsonify({"status": "loading", "message": "Whisper 模型正在加载中...", "jobs": counts}), 202
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    """列出本进程中的所有转写任务及其状态"""
+    return jsonify({"jobs": job_manager.list_jobs()}), 200
+
+@app.route('/jobs/<filename>/<action>', methods=['POST'])
+def job_action(filename, action):
+    """转写任务控制：cancel、pause、resume，或通过 priority 调整优先级 (请求体 {"priority": n})"""
+    data = request.get_json(silent=True) or {}
+    payload, code = control_job(filename, action, data.get('priority'))
+    return jsonify(payload), code
+
+# --- Socket.IO 任务订阅与控制事件 ---
+
+@socketio.on('subscribe_job')
+def on_subscribe_job(data):
+    """客户端订阅任务；所有订阅者断开超过配置的时间后，交互式任务会被自动取消"""
+    base_filename, _ = os.path.splitext(safe_filename((data or {}).get('filename', '')))
+    job = job_manager.subscribe(request.sid, base_filename)
+    return job.as_dict() if job else {"error": "找不到对应的转写任务"}
+
+@socketio.on('unsubscribe_job')
+def on_unsubscribe_job(data):
+    base_filename, _ = os.path.splitext(safe_filename((data or {}).get('filename', '')))
+    job_manager.unsubscribe(request.sid, base_filename)
+
+@socketio.on('disconnect')
+def on_disconnect(*args):
+    job_manager.unsubscribe(request.sid)
+
+@socketio.on('cancel_job')
+def on_cancel_job(data):
+    return control_job((data or {}).get('filename'), 'cancel')[0]
+
+@socketio.on('pause_job')
+def on_pause_job(data):
+    return control_job((data or {}).get('filename'), 'pause')[0]
+
+@socketio.on('resume_job')
+def on_resume_job(data):
+    return control_job((data or {}).get('filename'), 'resume')[0]
+
+@socketio.on('set_job_priority')
+def on_set_job_priority(data):
+    data = data or {}
+    return control_job(data.get('filename'), 'priority', data.get('priority'))[0]
+
+@app.route('/videos', methods=['GET'])
+def list_videos():
+    """列出目录中的媒体条目，可通过 status 参数过滤"""
+    try:
+        limit = min(max(int(request.args.get('limit', 100)), 1), 1000)
+        offset = max(int(request.args.get('offset', 0)), 0)
+    except ValueError:
+        return jsonify({"error": "limit 和 offset 必须是整数"}), 400
+    videos = catalog.list_media(status=request.args.get('status'), limit=limit, offset=offset)
+    return jsonify({"videos": videos}), 200
+
+@app.route('/videos/<filename>', methods=['GET'])
+def get_video(filename):
+    """查询单个媒体条目的转写进度和产物路径"""
+    base_filename, _ = os.path.splitext(safe_filename(filename))
+    media = catalog.get_media(base_filename)
+    if not media:
+        return jsonify({"error": "找不到对应的媒体条目"}), 404
+    return jsonify(media), 200
 
 @app.route('/summary', methods=['POST'])
 def get_summary():
-    """根据 VTT 字幕内容生成摘要，并实现缓存"""
+    """
+    根据 VTT 字幕内容生成摘要。结果按 (字幕, Prompt 模板, 模型, 参数) 缓存，
+    请求中可通过 model 字段指定模型，以便对同一视频比较不同模型的结果。
+    """
     data = request.get_json()
     if not data or 'filename' not in data:
         return jsonify({"error": "请求中缺少文件名"}), 400
 
-    filename = secure_filename(data['filename'])
+    filename = safe_filename(data['filename'])
     base_filename, _ = os.path.splitext(filename)
-    
     video_folder = os.path.join(DATA_FOLDER, base_filename)
-    summary_filepath = os.path.join(video_folder, f"{base_filename}.md")
-    json_summary_filepath = os.path.join(video_folder, f"{base_filename}-summary.json")
 
-    # --- 检查 Markdown 缓存 ---
-    if os.path.exists(summary_filepath):
-        try:
-            with open(summary_filepath, 'r', encoding='utf-8') as f:
-                summary_content = f.read()
-            print(f"找到 Markdown 摘要缓存: '{summary_filepath}'")
-            return jsonify({"summary": summary_content}), 200
-        except Exception as e:
-            print(f"读取 Markdown 摘要缓存文件时出错: {e}")
-
-    if not OPENAI_CLIENT or not PROMPT_TEMPLATE:
+    if not PROMPT_TEMPLATE:
         return jsonify({"error": "摘要服务尚未完全初始化，请稍后重试"}), 503
 
-    vtt_filepath = os.path.join(video_folder, f"{base_filename}.vtt")
-    if not os.path.exists(vtt_filepath):
+    media = catalog.get_media(base_filename)
+    if not media or media['status'] != catalog.STATUS_TRANSCRIBED or not media['vtt_path']:
         return jsonify({"error": "找不到对应的字幕文件"}), 404
 
     try:
-        with open(vtt_filepath, 'r', encoding='utf-8') as f:
+        with open(media['vtt_path'], 'r', encoding='utf-8') as f:
             vtt_content = f.read()
     except Exception as e:
         return jsonify({"error": f"读取字幕文件时出错: {e}"}), 500
 
-    # 1. 解析 VTT 获取时间戳
+    # 1. 解析 VTT 获取时间戳，并查询结果缓存
     segments = parse_vtt_to_segments(vtt_content)
-    summary_json_str = None
-
-    # --- 检查 JSON 缓存 ---
-    if os.path.exists(json_summary_filepath):
-        try:
-            with open(json_summary_filepath, 'r', encoding='utf-8') as f:
-                summary_json_str = f.read()
-            print(f"找到 JSON 摘要缓存: '{json_summary_filepath}'")
-        except Exception as e:
-            print(f"读取 JSON 摘要缓存时出错: {e}")
-            # 如果读取失败，则继续执行 AI 请求
+    openai_config = APP_CONFIG.get('openai', {})
+    model = data.get('model') or openai_config.get('model', 'gpt-3.5-turbo')
+    compaction = compaction_options(APP_CONFIG.get('compaction'))
+    entry, key_info = cached_summary(model, PROMPT_TEMPLATE, segments, compaction, video=base_filename)
+    cache_hit = entry is not None
+    coalesced = False
 
     try:
-        if not summary_json_str:
-            print(f"未找到 JSON 缓存，正在为 '{base_filename}.vtt' 请求 OpenAI 摘要...")
-            formatted_vtt = parse_vtt_to_custom_format(vtt_content)
-            final_prompt = PROMPT_TEMPLATE + "\n\n" + formatted_vtt
-            
-            openai_config = APP_CONFIG.get('openai', {})
-            model = openai_config.get('model', 'gpt-3.5-turbo')
-
-            response = OPENAI_CLIENT.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": "你是一位专业的视频内容结构分析师。请以 JSON 格式返回结果。"},
-                    {"role": "user", "content": final_prompt}
-                ],
-                response_format={"type": "json_object"}
+        if cache_hit:
+            print(f"命中摘要结果缓存: '{base_filename}' ({model}, {key_info[0][:12]})")
+        else:
+            if not OPENAI_CLIENT:
+                return jsonify({"error": "摘要服务尚未完全初始化，请稍后重试"}), 503
+            # 2. 请求 OpenAI 摘要，转换为 Markdown 并写入结果缓存 (同一键的并发请求只调用一次 OpenAI)
+            print(f"未命中摘要结果缓存，正在为 '{base_filename}.vtt' 请求 OpenAI 摘要 ({model})...")
+            entry, generated = generate_cached_summary(
+                OPENAI_CLIENT, model, PROMPT_TEMPLATE, segments, base_filename, key_info,
+                compaction=compaction, max_cache_bytes=LLM_CACHE_MAX_BYTES
             )
-            summary_json_str = response.choices[0].message.content
+            cache_hit = coalesced = not generated
             print(f"成功获取 '{base_filename}.vtt' 的 JSON 摘要。")
 
-            # 保存 JSON 摘要
-            with open(json_summary_filepath, 'w', encoding='utf-8') as f:
-                f.write(summary_json_str)
-
-        # 2. 将 JSON 转换为 Markdown
-        summary_data = json.loads(summary_json_str)
-        # OpenAI 返回的 JSON 可能包含在一个根键中（如 {"summary": [...]}），也可能直接是列表
-        summary_root = []
-        if isinstance(summary_data, dict):
-            summary_root = summary_data.get('summary', summary_data)
-        else:
-            summary_root = summary_data # 如果是列表，直接使用
-        
-        # generate_markdown_from_json 函数内部会处理 summary_root 是字典还是列表的情况
-        markdown_summary = generate_markdown_from_json(summary_root, segments)
-
-        # 3. 保存 Markdown 到缓存文件
-        with open(summary_filepath, 'w', encoding='utf-8') as f:
-            f.write(markdown_summary)
-        print(f"摘要已缓存到: '{summary_filepath}'")
+        # 3. 导出为视频目录中的最新摘要文件
+        summary_filepath, json_summary_filepath = write_summary_artifacts(video_folder, base_filename, entry)
+        catalog.record_summary(base_filename, summary_filepath, json_summary_filepath)
+        print(f"摘要已保存到: '{summary_filepath}'")
 
-        return jsonify({"summary": markdown_summary}), 200
+        response = {
+            "summary": entry['markdown'],
+            "cache": {"hit": cache_hit, "coalesced": coalesced, "key": entry['key'], "model": model}
+        }
+        if not cache_hit and entry['stats']:
+            response["stats"] = entry['stats']
+        return jsonify(response), 200
 
     except Exception as e:
         print(f"请求 OpenAI API 或处理摘要时出错: {e}")
         return jsonify({"error": f"请求 OpenAI API 或处理摘要时出错: {e}"}), 500
 
+@app.route('/summary/variants', methods=['GET'])
+def list_summary_variants():
+    """列出一个视频已缓存的所有摘要变体 (模型、Prompt、参数)"""
+    filename = request.args.get('filename')
+    if not filename:
+        return jsonify({"error": "请求中缺少文件名"}), 400
+    base_filename, _ = os.path.splitext(safe_filename(filename))
+    return jsonify({"filename": base_filename, "variants": llm_cache.list_variants(base_filename)}), 200
+
+@app.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """返回摘要结果缓存的命中率和磁盘占用"""
+    return jsonify(llm_cache.cache_stats(max_bytes=LLM_CACHE_MAX_BYTES)), 200
+
+@app.route('/search', methods=['GET'])
+def search_subtitles():
+    """在所有已转写的字幕中全文检索，返回按相关度排序的命中字幕段 (时间戳单位为毫秒)"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"error": "请求中缺少检索词"}), 400
+
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+        offset = max(int(request.args.get('offset', 0)), 0)
+    except ValueError:
+        return jsonify({"error": "limit 和 offset 必须是整数"}), 400
+
+    started = time.time()
+    try:
+        hits = search(query, limit=limit, offset=offset)
+    except Exception as e:
+        print(f"检索字幕时出错: {e}")
+        return jsonify({"error": f"检索字幕时出错: {e}"}), 500
+
+    return jsonify({
+        "query": query,
+        "hits": hits,
+        "elapsed_ms": round((time.time() - started) * 1000, 2)
+    }), 200
+
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve(path):
@@ -312,50 +514,13 @@ def serve(path):
     else:
         return send_from_directory(app.static_folder, 'index.html')
 
-def generate_markdown_from_json(data, segments, level=1):
-    """根据 01.0101--.md 的格式，并使用 VTT segments 来获取时间戳。"""
-    markdown = ""
-    if isinstance(data, dict):
-        data = [data]
-
-    for node in data:
-        title = node.get('title', '无标题')
-        description = node.get('description', '')
-        index = node.get('index')
-
-        # --- 通过索引从 segments 列表中获取时间戳 ---
-        timestamp_str = "00:00:00"
-        if index is not None and 0 <= index < len(segments):
-            timestamp = segments[index]['start']
-            # 格式化时间戳，去掉毫秒部分
-            timestamp_str = timestamp.split('.')[0]
-        
-        timestamp_link = f"[{timestamp_str}](#{timestamp_str})"
-
-        if level == 1:
-            markdown += f"## {title} {timestamp_link}\n\n"
-            if description:
-                markdown += f"{description}\n\n"
-        elif level == 2:
-            markdown += f"### **{title}** {timestamp_link}\n\n"
-            if description:
-                markdown += f"{description}\n\n"
-        else:
-            indent = "  " * (level - 3)
-            line = f"{indent}- **{title}**"
-            if description:
-                line += f" ：{description}"
-            line += f" {timestamp_link}\n"
-            markdown += line
-            
-        # 递归处理子节点
-        if 'children' in node and node['children']:
-            markdown += generate_markdown_from_json(node['children'], segments, level + 1)
-            
-    return markdown
-
 if __name__ == '__main__':
     # --- 启动后台线程加载所有依赖 ---
+    # --- 登记本进程心跳，其他进程据此判断本进程转写中的条目是否仍有人负责 ---
+    # --- 同时登记本进程任务的最高优先级，批处理进程会为交互式上传让出转写槽位 ---
+    catalog.start_heartbeat('server', demand=job_manager.demand,
+                            on_other_priority=job_manager.set_external_priority)
+
     print("主线程：准备启动依赖加载线程...")
     loader_thread = threading.Thread(target=load_dependencies)
     loader_thread.daemon = True
@@ -0,0 +1,161 @@
+import os
+import glob
+import struct
+import tempfile
+import numpy as np
+import whisper
+
+# --- 缓存文件格式 ---
+# 固定 64 字节头部，之后紧跟原始 PCM 采样数据 (单声道, 小端序)。
+# 头部字段: 魔数, 版本, 采样格式, 采样率, 采样数, 源文件大小, 源文件修改时间(ns)
+PCM_MAGIC = b'AVSPCM'
+PCM_VERSION = 1
+HEADER_FORMAT = '<6sBcIQQq'
+HEADER_SIZE = 64
+PCM_EXTENSION = '.pcm'
+
+DTYPES = {
+    'float32': (b'f', np.dtype('<f4')),
+    'int16': (b'h', np.dtype('<i2')),
+}
+DTYPE_CODES = {code: dtype for code, dtype in DTYPES.values()}
+
+# data/ 下所有 PCM 缓存的默认总大小上限 (20 GiB)
+DEFAULT_MAX_CACHE_BYTES = 20 * 1024 ** 3
+
+def pcm_cache_path(video_folder, base_filename):
+    """返回视频专属目录下 PCM 缓存文件的路径。"""
+    return os.path.join(video_folder, base_filename + PCM_EXTENSION)
+
+def _source_fingerprint(audio_file):
+    stat = os.stat(audio_file)
+    return stat.st_size, stat.st_mtime_ns
+
+def read_pcm_header(cache_path):
+    """
+    读取并校验缓存文件头部。返回 (dtype, sample_rate, num_samples, source_size, source_mtime_ns)，
+    文件不存在或格式不正确时返回 None。
+    """
+    try:
+        with open(cache_path, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+        file_size = os.path.getsize(cache_path)
+    except OSError:
+        return None
+    if len(header) < HEADER_SIZE:
+        return None
+
+    magic, version, code, sample_rate, num_samples, source_size, source_mtime_ns = \
+        struct.unpack_from(HEADER_FORMAT, header)
+    if magic != PCM_MAGIC or version != PCM_VERSION or code not in DTYPE_CODES:
+        return None
+    dtype = DTYPE_CODES[code]
+    # 写入中断会留下截断的文件，按长度校验
+    if file_size != HEADER_SIZE + num_samples * dtype.itemsize:
+        return None
+    return dtype, sample_rate, num_samples, source_size, source_mtime_ns
+
+def write_pcm_cache(cache_path, audio, source_fingerprint, dtype='float32'):
+    """
+    将 whisper.load_audio 解码得到的 float32 音频写入缓存文件。
+    先写入同目录下的临时文件，再原子替换，避免并发读取到不完整的文件。
+    """
+    code, np_dtype = DTYPES[dtype]
+    if np_dtype.kind == 'i':
+        data = np.clip(audio * 32768.0, -32768, 32767).astype(np_dtype)
+    else:
+        data = audio.astype(np_dtype, copy=False)
+
+    source_size, source_mtime_ns = source_fingerprint
+    header = struct.pack(HEADER_FORMAT, PCM_MAGIC, PCM_VERSION, code, whisper.audio.SAMPLE_RATE,
+                         data.shape[0], source_size, source_mtime_ns)
+    header = header.ljust(HEADER_SIZE, b'\0')
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path) or '.', suffix=PCM_EXTENSION + '.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(header)
+            data.tofile(f)
+        os.replace(tmp_path, cache_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def open_pcm_cache(cache_path):
+    """
+    以内存映射方式打开缓存文件，返回一维数组；切片不会复制数据，只会读取实际访问的页面。
+    使用写时复制模式 ('c')，使数组可写 (torch.from_numpy 要求)，但修改不会写回文件。
+    """
+    header = read_pcm_header(cache_path)
+    if header is None:
+        return None
+    dtype, _, num_samples, _, _ = header
+    if num_samples == 0:
+        return np.zeros(0, dtype=np.float32)
+    return np.memmap(cache_path, dtype=dtype, mode='c', offset=HEADER_SIZE, shape=(num_samples,))
+
+def load_audio_cached(audio_file, cache_path, dtype='float32', max_cache_bytes=DEFAULT_MAX_CACHE_BYTES):
+    """
+    加载音频，优先使用已解码的 PCM 缓存。
+    缓存缺失或源文件已变化时，调用 whisper.load_audio (ffmpeg) 解码并写入缓存，然后按大小淘汰旧缓存。
+    返回的数组可能是 int16，取出切片后需用 to_float32 转换。
+    """
+    fingerprint = _source_fingerprint(audio_file)
+    header = read_pcm_header(cache_path)
+    if header is not None and header[1] == whisper.audio.SAMPLE_RATE and tuple(header[3:]) == fingerprint:
+        print(f"使用已解码的 PCM 缓存: '{cache_path}'")
+        # 更新修改时间，作为淘汰时的最近使用时间
+        os.utime(cache_path)
+        return open_pcm_cache(cache_path)
+
+    audio = whisper.load_audio(audio_file)
+    try:
+        write_pcm_cache(cache_path, audio, fingerprint, dtype=dtype)
+        print(f"已写入 PCM 缓存: '{cache_path}'")
+    except Exception as e:
+        print(f"写入 PCM 缓存 '{cache_path}' 时出错: {e}")
+        return audio
+
+    evict_pcm_cache(os.path.dirname(os.path.dirname(cache_path)) or '.', max_cache_bytes, keep=cache_path)
+    mapped = open_pcm_cache(cache_path)
+    return mapped if mapped is not None else audio
+
+def to_float32(chunk):
+    """将缓存中取出的切片转换为 Whisper 需要的 float32 [-1, 1] 数组。float32 切片原样返回。"""
+    if chunk.dtype.kind == 'i':
+        return chunk.astype(np.float32) / 32768.0
+    return chunk
+
+def evict_pcm_cache(data_folder, max_bytes, keep=None):
+    """
+    当 data_folder/*/ 下的 PCM 缓存总大小超过 max_bytes 时，按最近使用时间从旧到新删除。
+    keep 指定的文件 (通常是刚写入的缓存) 不会被删除。返回释放的字节数。
+    """
+    if max_bytes is None:
+        return 0
+    entries = []
+    for path in glob.glob(os.path.join(data_folder, '*', '*' + PCM_EXTENSION)):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    freed = 0
+    keep = os.path.abspath(keep) if keep else None
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if keep and os.path.abspath(path) == keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError as e:
+            print(f"删除 PCM 缓存 '{path}' 时出错: {e}")
+            continue
+        print(f"PCM 缓存超出上限，已删除: '{path}'")
+        total -= size
+        freed += size
+    return freed
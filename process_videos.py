@@ -1,45 +1,542 @@
 import os
-import glob
-from transcription import load_whisper_model, transcribe_audio
+import json
+import time
+import queue
+import argparse
+import hashlib
+import threading
+import datetime
+import jobs
+import catalog
+import llm_cache
+from storage import DATA_FOLDER, safe_filename
+from transcription import load_whisper_model, transcribe_audio, ALLOWED_EXTENSIONS
+from openai_client import get_openai_client
+from summarizer import cached_summary, generate_cached_summary, write_summary_artifacts
+from transcript_compaction import compaction_options
+from vtt_utils import parse_vtt_to_segments
 
-def main():
+# --- 默认配置 ---
+DEFAULT_MANIFEST = os.path.join(DATA_FOLDER, 'batch_manifest.jsonl')
+MANIFEST_VERSION = 2
+
+# --- 清单中每个文件的状态 ---
+STATUS_PENDING = 'pending'
+STATUS_TRANSCRIBED = 'transcribed'
+STATUS_SUMMARIZED = 'summarized'
+STATUS_FAILED = 'failed'
+
+# 放入队列后通知工作线程退出的哨兵对象
+_STOP = object()
+
+def discover_media_files(root):
     """
-    主函数，用于加载模型并处理多个音频文件。
+    递归查找 root 目录下所有允许类型的媒体文件，返回按路径排序的相对路径列表。
     """
-    # --- 配置 ---
-    MODEL_NAME = "large"
-    # 定义要处理的音频文件所在的目录
-    AUDIO_DIRECTORY = "." 
-    # 定义文件匹配模式，例如 "*.mp3", "*.wav" 等
-    FILE_PATTERN = "*.mp3"
+    data_root = os.path.abspath(DATA_FOLDER)
+    media_files = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        # 跳过 data 目录，避免把已上传的副本再次当作输入
+        dirnames[:] = sorted(d for d in dirnames
+                             if not d.startswith('.') and os.path.abspath(os.path.join(dirpath, d)) != data_root)
+        for name in filenames:
+            if '.' in name and name.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS:
+                media_files.append(os.path.relpath(os.path.join(dirpath, name), root))
+    return sorted(media_files)
 
-    # --- 1. 加载模型 (只执行一次) ---
-    print("--- 正在初始化并加载 Whisper 模型 ---")
-    model = load_whisper_model(MODEL_NAME)
+def _name_taken(base_filename, rel_path, abs_path, used):
+    """目录名是否已被其他文件占用：本次批处理中的其他文件、网页上传的文件或目录中的其他条目。"""
+    if base_filename in used:
+        return used[base_filename] != rel_path
+    media = catalog.get_media(base_filename)
+    if media:
+        return media['media_path'] != os.path.abspath(abs_path)
+    return os.path.isdir(os.path.join(DATA_FOLDER, base_filename))
 
-    if not model:
-        print("模型加载失败，程序退出。")
-        return
+def make_base_filename(rel_path, abs_path, used):
+    """
+    根据相对路径生成 data/ 下的目录名 (例如 课程/第一讲.mp4 -> 课程_第一讲)，保留中文等 Unicode 字符。
+    名字已被其他文件占用时追加路径哈希，避免两个文件共用同一个目录及其中的临时分块。
+    """
+    stem = os.path.splitext(rel_path)[0]
+    base_filename = safe_filename(stem)
+    if not base_filename or _name_taken(base_filename, rel_path, abs_path, used):
+        digest = hashlib.sha1(rel_path.encode('utf-8')).hexdigest()[:8]
+        base_filename = f"{base_filename or 'media'}_{digest}"
+    used[base_filename] = rel_path
+    return base_filename
+
+class BatchManifest:
+    """
+    持久化的批处理清单 (JSON Lines)。记录每个媒体文件的处理状态，重新运行时跳过已完成的文件。
+    每次更新只向文件末尾追加一行变更记录，开销与清单大小无关；加载时按顺序重放所有记录，
+    进程中途退出时留下的不完整末行会被忽略。compact() 将清单重写为每个文件一行。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.data = {'version': MANIFEST_VERSION, 'items': {}, 'progress': {}}
+        self._file = None
+        if os.path.exists(path):
+            try:
+                self._load()
+            except Exception as e:
+                print(f"读取清单文件 '{path}' 时出错，将重新生成: {e}")
+                self.data = {'version': MANIFEST_VERSION, 'items': {}, 'progress': {}}
+
+    def _load(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    print(f"忽略清单 '{self.path}' 第 {line_number} 行的不完整记录")
+                    continue
+                if 'version' in record:
+                    if record['version'] != MANIFEST_VERSION:
+                        print(f"清单版本不匹配，将重新生成: '{self.path}'")
+                        return
+                elif 'progress' in record:
+                    self.data['progress'] = record['progress']
+                else:
+                    self.items.setdefault(record['path'], {}).update(record['fields'])
+
+    @property
+    def items(self):
+        return self.data['items']
+
+    def get(self, rel_path):
+        with self.lock:
+            item = self.items.get(rel_path)
+            return dict(item) if item else None
+
+    def update(self, rel_path, **fields):
+        with self.lock:
+            fields['updated_at'] = datetime.datetime.now().isoformat(timespec='seconds')
+            self.items.setdefault(rel_path, {}).update(fields)
+            self._append_locked({'path': rel_path, 'fields': fields})
+
+    def set_progress(self, progress):
+        with self.lock:
+            self.data['progress'] = progress
+            self._append_locked({'progress': progress})
+
+    def compact(self):
+        """将清单重写为版本行 + 每个文件一行 + 最近一次进度，先写临时文件再原子替换。"""
+        with self.lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(json.dumps({'version': MANIFEST_VERSION}) + '\n')
+                for rel_path, item in self.items.items():
+                    f.write(json.dumps({'path': rel_path, 'fields': item}, ensure_ascii=False) + '\n')
+                if self.data['progress']:
+                    f.write(json.dumps({'progress': self.data['progress']}, ensure_ascii=False) + '\n')
+            os.replace(tmp_path, self.path)
+
+    def close(self):
+        with self.lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+    def _ends_with_newline(self):
+        with open(self.path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
+
+    def _append_locked(self, record):
+        if self._file is None:
+            if not os.path.exists(self.path):
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                with open(self.path, 'w', encoding='utf-8') as f:
+                    f.write(json.dumps({'version': MANIFEST_VERSION}) + '\n')
+            self._file = open(self.path, 'a', encoding='utf-8')
+            # 上次运行中途退出时末行可能不完整，先换行，避免新记录与其拼接
+            if self._file.tell() and not self._ends_with_newline():
+                self._file.write('\n')
+        self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._file.flush()
+
+class StageStats:
+    """单个处理阶段的计数与耗时统计。"""
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+        self.active = 0
+        self.busy_seconds = 0.0
+
+    def eta_seconds(self):
+        finished = self.done + self.failed
+        remaining = self.total - finished
+        if remaining <= 0:
+            return 0.0
+        if finished == 0:
+            return None
+        return remaining * (self.busy_seconds / finished) / max(self.workers, 1)
+
+    def as_dict(self):
+        eta = self.eta_seconds()
+        return {
+            'total': self.total,
+            'done': self.done,
+            'failed': self.failed,
+            'active': self.active,
+            'workers': self.workers,
+            'eta_seconds': round(eta, 1) if eta is not None else None
+        }
+
+class Progress:
+    """线程安全的进度与 ETA 统计，覆盖转写和摘要两个阶段。"""
+
+    def __init__(self, transcribe_workers, summary_workers):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.skipped = 0
+        self.stages = {
+            'transcribe': StageStats('transcribe', transcribe_workers),
+            'summary': StageStats('summary', summary_workers)
+        }
+
+    def add_total(self, stage, count=1):
+        with self.lock:
+            self.stages[stage].total += count
+
+    def add_skipped(self):
+        with self.lock:
+            self.skipped += 1
+
+    def start(self, stage):
+        with self.lock:
+            self.stages[stage].active += 1
+
+    def finish(self, stage, elapsed, ok):
+        with self.lock:
+            stats = self.stages[stage]
+            stats.active -= 1
+            stats.busy_seconds += elapsed
+            if ok:
+                stats.done += 1
+            else:
+                stats.failed += 1
+
+    def snapshot(self):
+        with self.lock:
+            stages = {name: stats.as_dict() for name, stats in self.stages.items()}
+            etas = [s['eta_seconds'] for s in stages.values()]
+            # 两个阶段并行运行，整体 ETA 取决于最慢的阶段；任一阶段尚无样本时无法估计
+            overall_eta = None if None in etas else max(etas)
+            return {
+                'elapsed_seconds': round(time.time() - self.started_at, 1),
+                'skipped': self.skipped,
+                'stages': stages,
+                'eta_seconds': overall_eta,
+                'updated_at': datetime.datetime.now().isoformat(timespec='seconds')
+            }
 
-    # --- 2. 查找所有匹配的音频文件 ---
-    # 你可以修改这里的逻辑来处理特定的文件列表
-    search_path = os.path.join(AUDIO_DIRECTORY, FILE_PATTERN)
-    audio_files = glob.glob(search_path)
+def format_duration(seconds):
+    if seconds is None:
+        return "--:--:--"
+    seconds = int(seconds)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+
+def format_progress(snapshot):
+    """将进度快照格式化为一行可读的报告。"""
+    parts = [f"[{format_duration(snapshot['elapsed_seconds'])}]"]
+    for name, stats in snapshot['stages'].items():
+        parts.append(
+            f"{name}: {stats['done']}/{stats['total']} 完成, {stats['failed']} 失败, "
+            f"{stats['active']}/{stats['workers']} 运行中, ETA {format_duration(stats['eta_seconds'])}"
+        )
+    parts.append(f"跳过: {snapshot['skipped']}")
+    parts.append(f"总 ETA: {format_duration(snapshot['eta_seconds'])}")
+    return " | ".join(parts)
+
+def load_summary_settings(config_path, prompt_path):
+    """加载摘要阶段所需的配置、Prompt 模板和 OpenAI 客户端。"""
+    with open(config_path, 'r', encoding='utf-8') as f:
+        app_config = json.load(f)
+    with open(prompt_path, 'r', encoding='utf-8') as f:
+        prompt_template = f.read()
+    openai_config = app_config.get('openai', {})
+    client = get_openai_client(
+        api_key=openai_config.get('api_key'),
+        base_url=openai_config.get('base_url'),
+        proxy=openai_config.get('proxy')
+    )
+    return {
+        'client': client,
+        'model': openai_config.get('model', 'gpt-3.5-turbo'),
+        'prompt_template': prompt_template,
+        'compaction': compaction_options(app_config.get('compaction')),
+        'max_cache_bytes': app_config.get('llm_cache', {}).get('max_bytes', llm_cache.DEFAULT_MAX_CACHE_BYTES)
+    }
+
+def summarize_vtt(settings, vtt_path, base_filename):
+    """
+    为一个已完成的 VTT 文件生成 JSON 与 Markdown 摘要，返回 Markdown 文件路径。
+    相同字幕、Prompt、模型和参数的结果直接从结果缓存读取。
+    """
+    with open(vtt_path, 'r', encoding='utf-8') as f:
+        segments = parse_vtt_to_segments(f.read())
+
+    entry, key_info = cached_summary(settings['model'], settings['prompt_template'], segments,
+                                     settings['compaction'], video=base_filename)
+    if entry is None:
+        entry, _ = generate_cached_summary(settings['client'], settings['model'], settings['prompt_template'],
+                                        segments, base_filename, key_info, compaction=settings['compaction'],
+                                        max_cache_bytes=settings['max_cache_bytes'])
+    else:
+        print(f"命中摘要结果缓存: '{base_filename}'")
+
+    video_folder = os.path.join(DATA_FOLDER, base_filename)
+    summary_filepath, json_summary_filepath = write_summary_artifacts(video_folder, base_filename, entry)
+    catalog.record_summary(base_filename, summary_filepath, json_summary_filepath)
+    return summary_filepath
+
+class BatchPipeline:
+    """
+    两阶段并发批处理流水线：
+    发现文件 -> [有界队列] -> 转写工作线程 -> [有界队列] -> 摘要工作线程
+    每个转写工作线程持有独立的 Whisper 模型实例。
+    转写任务以后台优先级提交给 JobManager：其他进程 (例如 Web 服务器) 有更高优先级的任务时，
+    正在转写的文件会在分块边界让出，等其他进程的任务完成后继续。
+    """
+
+    def __init__(self, root, manifest, model_name="large", transcribe_workers=1, summary_workers=2,
+                 queue_size=4, summary_settings=None, report_interval=30):
+        self.root = root
+        self.manifest = manifest
+        self.model_name = model_name
+        self.transcribe_workers = transcribe_workers
+        self.summary_workers = summary_workers if summary_settings else 0
+        self.summary_settings = summary_settings
+        self.report_interval = report_interval
+        self.transcribe_queue = queue.Queue(maxsize=queue_size)
+        self.summary_queue = queue.Queue(maxsize=queue_size)
+        self.progress = Progress(transcribe_workers, self.summary_workers)
+        self.job_manager = jobs.JobManager(max_running=transcribe_workers, idle_cancel_seconds=None)
+        self.finished = threading.Event()
+
+    def run(self):
+        media_files = discover_media_files(self.root)
+        if not media_files:
+            print(f"在目录 '{self.root}' 中未找到任何允许类型的媒体文件: {sorted(ALLOWED_EXTENSIONS)}")
+            return self.progress.snapshot()
+        print(f"\n--- 找到 {len(media_files)} 个媒体文件, 准备开始处理 ---")
+        # 合并上次运行追加的变更记录，之后每次更新只追加一行
+        self.manifest.compact()
+
+        transcribe_threads = [threading.Thread(target=self._transcribe_worker, args=(i,), daemon=True)
+                              for i in range(self.transcribe_workers)]
+        summary_threads = [threading.Thread(target=self._summary_worker, daemon=True)
+                           for _ in range(self.summary_workers)]
+        reporter = threading.Thread(target=self._report_loop, daemon=True)
+        for t in transcribe_threads + summary_threads:
+            t.start()
+        reporter.start()
+
+        # --- 生产者：在主线程中按顺序入队，队列满时阻塞 ---
+        used_names = {item['base_filename']: rel_path for rel_path, item in self.manifest.items.items()
+                      if 'base_filename' in item}
+        for rel_path in media_files:
+            self._enqueue(rel_path, used_names)
+
+        for _ in transcribe_threads:
+            self.transcribe_queue.put(_STOP)
+        for t in transcribe_threads:
+            t.join()
+        for _ in summary_threads:
+            self.summary_queue.put(_STOP)
+        for t in summary_threads:
+            t.join()
+
+        self.finished.set()
+        reporter.join()
+        snapshot = self.progress.snapshot()
+        self.manifest.set_progress(snapshot)
+        self.manifest.compact()
+        print(format_progress(snapshot))
+        return snapshot
+
+    def _enqueue(self, rel_path, used_names):
+        abs_path = os.path.join(self.root, rel_path)
+        try:
+            stat = os.stat(abs_path)
+        except OSError as e:
+            # 扫描后文件被删除或网络共享暂时不可用时，只标记该文件失败，不中断整个批处理
+            print(f"无法读取 '{rel_path}'，跳过: {e}")
+            self.progress.add_total('transcribe')
+            self.progress.start('transcribe')
+            self.progress.finish('transcribe', 0.0, False)
+            self.manifest.update(rel_path, status=STATUS_FAILED, error=f"无法读取文件: {e}")
+            return
+        item = self.manifest.get(rel_path)
+        unchanged = item and item.get('size') == stat.st_size and item.get('mtime') == stat.st_mtime
+
+        if unchanged:
+            base_filename = item['base_filename']
+            status = item.get('status')
+            vtt_path = item.get('vtt_path')
+            if status == STATUS_SUMMARIZED or (status == STATUS_TRANSCRIBED and not self.summary_workers):
+                self.progress.add_skipped()
+                return
+            if status == STATUS_TRANSCRIBED and vtt_path and os.path.exists(vtt_path):
+                # 转写已完成，仅需重新进入摘要阶段
+                self.progress.add_total('summary')
+                self.summary_queue.put((rel_path, base_filename, vtt_path))
+                return
+        else:
+            base_filename = make_base_filename(rel_path, abs_path, used_names)
+
+        self.manifest.update(rel_path, base_filename=base_filename, size=stat.st_size,
+                             mtime=stat.st_mtime, status=STATUS_PENDING, error=None)
+        self.progress.add_total('transcribe')
+        self.transcribe_queue.put((rel_path, base_filename))
+
+    def _transcribe_worker(self, worker_id):
+        model = None
+        model_loaded = False
+        while True:
+            task = self.transcribe_queue.get()
+            if task is _STOP:
+                break
+            rel_path, base_filename = task
+            # 在取得第一个任务时才加载模型，所有文件都被跳过时不占用显存
+            if not model_loaded:
+                print(f"转写工作线程 {worker_id}: 正在加载 Whisper 模型 '{self.model_name}'...")
+                model = load_whisper_model(self.model_name)
+                model_loaded = True
+            if not model:
+                self.progress.start('transcribe')
+                self.progress.finish('transcribe', 0.0, False)
+                self.manifest.update(rel_path, status=STATUS_FAILED, error='模型加载失败')
+                continue
+
+            self.progress.start('transcribe')
+            started = time.time()
+            vtt_path = None
+            error = None
+            audio_file = os.path.join(self.root, rel_path)
+            job, _ = self.job_manager.submit(base_filename, os.path.basename(rel_path), audio_file,
+                                             priority=jobs.PRIORITY_BACKGROUND, interactive=False)
+            try:
+                vtt_path = self.job_manager.run(job, transcribe_audio, model=model, audio_file=audio_file,
+                                                base_filename=base_filename,
+                                                original_filename=os.path.basename(rel_path))
+            except Exception as e:
+                error = str(e)
+                print(f"转写 '{rel_path}' 时出错: {e}")
+            self.progress.finish('transcribe', time.time() - started, vtt_path is not None)
+
+            if vtt_path is None:
+                self.manifest.update(rel_path, status=STATUS_FAILED, error=error or '未生成任何字幕文件')
+                continue
+
+            self.manifest.update(rel_path, status=STATUS_TRANSCRIBED, vtt_path=vtt_path, error=None)
+            if self.summary_workers:
+                self.progress.add_total('summary')
+                self.summary_queue.put((rel_path, base_filename, vtt_path))
+
+    def _summary_worker(self):
+        while True:
+            task = self.summary_queue.get()
+            if task is _STOP:
+                break
+            rel_path, base_filename, vtt_path = task
+
+            self.progress.start('summary')
+            started = time.time()
+            try:
+                summary_path = summarize_vtt(self.summary_settings, vtt_path, base_filename)
+            except Exception as e:
+                print(f"为 '{rel_path}' 生成摘要时出错: {e}")
+                self.progress.finish('summary', time.time() - started, False)
+                # 保留 transcribed 状态，下次运行时只重试摘要阶段
+                self.manifest.update(rel_path, error=f"摘要失败: {e}")
+                continue
+            self.progress.finish('summary', time.time() - started, True)
+            self.manifest.update(rel_path, status=STATUS_SUMMARIZED, summary_path=summary_path, error=None)
+
+    def _report_loop(self):
+        while not self.finished.wait(self.report_interval):
+            snapshot = self.progress.snapshot()
+            self.manifest.set_progress(snapshot)
+            print(format_progress(snapshot))
+
+def print_manifest_status(manifest):
+    """打印清单中记录的状态汇总和最近一次进度报告。"""
+    counts = {}
+    for item in manifest.items.values():
+        counts[item.get('status', STATUS_PENDING)] = counts.get(item.get('status', STATUS_PENDING), 0) + 1
+    print(f"清单: '{manifest.path}', 共 {len(manifest.items)} 个文件")
+    for status, count in sorted(counts.items()):
+        print(f"  {status}: {count}")
+    for rel_path, item in sorted(manifest.items.items()):
+        if item.get('status') == STATUS_FAILED or item.get('error'):
+            print(f"  [{item.get('status')}] {rel_path}: {item.get('error')}")
+    if manifest.data.get('progress'):
+        print(format_progress(manifest.data['progress']))
+
+def main():
+    """
+    主函数，递归扫描媒体库并通过并发流水线完成转写和摘要。
+    """
+    parser = argparse.ArgumentParser(description="批量转写并摘要媒体库中的所有音视频文件。")
+    parser.add_argument('root', nargs='?', default='.', help="要扫描的媒体库根目录 (默认: 当前目录)")
+    parser.add_argument('--model', default='large', help="Whisper 模型名称 (默认: large)")
+    parser.add_argument('--transcribe-workers', type=int, default=1,
+                        help="转写工作线程数，每个线程加载一份模型 (默认: 1)")
+    parser.add_argument('--summary-workers', type=int, default=2, help="摘要工作线程数 (默认: 2)")
+    parser.add_argument('--queue-size', type=int, default=4, help="阶段间队列的最大长度 (默认: 4)")
+    parser.add_argument('--manifest', default=DEFAULT_MANIFEST, help=f"清单文件路径 (默认: {DEFAULT_MANIFEST})")
+    parser.add_argument('--config', default='config.json', help="OpenAI 配置文件 (默认: config.json)")
+    parser.add_argument('--prompt', default='prompt_summary.txt', help="摘要 Prompt 模板 (默认: prompt_summary.txt)")
+    parser.add_argument('--no-summary', action='store_true', help="只转写，不生成摘要")
+    parser.add_argument('--report-interval', type=float, default=30, help="进度报告间隔秒数 (默认: 30)")
+    parser.add_argument('--status', action='store_true', help="只打印清单中的状态和进度，不执行处理")
+    args = parser.parse_args()
 
-    if not audio_files:
-        print(f"在目录 '{AUDIO_DIRECTORY}' 中未找到匹配 '{FILE_PATTERN}' 的文件。")
+    manifest = BatchManifest(args.manifest)
+    if args.status:
+        print_manifest_status(manifest)
         return
-        
-    print(f"\n--- 找到 {len(audio_files)} 个音频文件, 准备开始处理 ---")
-    print(audio_files)
 
-    # --- 3. 遍历并处理每个音频文件 ---
-    for i, audio_file in enumerate(audio_files):
-        print(f"\n\n=============================================")
-        print(f"===> 正在处理第 {i+1}/{len(audio_files)} 个文件: {audio_file}")
-        print(f"=============================================")
-        transcribe_audio(model, audio_file)
+    summary_settings = None
+    if not args.no_summary:
+        try:
+            summary_settings = load_summary_settings(args.config, args.prompt)
+        except Exception as e:
+            print(f"加载摘要配置失败，将只执行转写: {e}")
 
+    pipeline = BatchPipeline(
+        root=args.root,
+        manifest=manifest,
+        model_name=args.model,
+        transcribe_workers=max(args.transcribe_workers, 1),
+        summary_workers=max(args.summary_workers, 1),
+        queue_size=max(args.queue_size, 1),
+        summary_settings=summary_settings,
+        report_interval=args.report_interval
+    )
+    # 登记本进程心跳，同时运行的 Web 服务器不会把本进程转写中的条目当作中断任务恢复；
+    # 服务器有交互式上传时，批处理在分块边界让出转写槽位
+    heartbeat = catalog.start_heartbeat('batch', demand=pipeline.job_manager.demand,
+                                        on_other_priority=pipeline.job_manager.set_external_priority)
+    try:
+        pipeline.run()
+    finally:
+        heartbeat.set()
     print("\n\n--- 所有任务已完成 ---")
 
 
@@ -0,0 +1,193 @@
+import os
+import re
+import sys
+import datetime
+from storage import DATA_FOLDER, CJK_CHARS, data_path, connect_db
+from vtt_utils import parse_vtt_to_segments, timestamp_to_ms
+
+# --- 配置 ---
+DEFAULT_INDEX_PATH = data_path('search_index.db')
+
+_TOKEN_RE = re.compile(f'[{CJK_CHARS}]+|(?:(?![{CJK_CHARS}])[^\\W_])+')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    video TEXT PRIMARY KEY,
+    vtt_size INTEGER NOT NULL,
+    vtt_mtime_ns INTEGER NOT NULL,
+    segment_count INTEGER NOT NULL,
+    indexed_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS segments (
+    id INTEGER PRIMARY KEY,
+    video TEXT NOT NULL,
+    segment INTEGER NOT NULL,
+    start_ms INTEGER NOT NULL,
+    end_ms INTEGER NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS segments_video ON segments (video);
+CREATE VIRTUAL TABLE IF NOT EXISTS segment_fts USING fts5(tokens, tokenize='unicode61');
+"""
+
+def _is_cjk(run):
+    return bool(re.match(f'[{CJK_CHARS}]', run))
+
+def tokenize_for_index(text):
+    """
+    将字幕文本切分为索引词元。
+    拉丁文字按单词切分并转为小写；CJK 连续文本切分为重叠的二元组 (bigram)，
+    并在每段末尾追加最后一个单字，保证任何单字都能通过前缀查询命中。
+    """
+    tokens = []
+    for run in _TOKEN_RE.findall(text):
+        if not _is_cjk(run):
+            tokens.append(run.lower())
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+            tokens.append(run[-1])
+    return tokens
+
+def _quote(token):
+    return '"' + token.replace('"', '""') + '"'
+
+def build_match_query(query):
+    """
+    将用户查询转换为 FTS5 MATCH 表达式。
+    每个 CJK 片段转换为二元组短语查询 (要求相邻)，单个汉字使用前缀查询，多个词之间为 AND 关系。
+    查询中没有可检索的词元时返回 None。
+    """
+    clauses = []
+    for run in _TOKEN_RE.findall(query):
+        if not _is_cjk(run):
+            clauses.append(_quote(run.lower()))
+        elif len(run) == 1:
+            clauses.append(_quote(run) + '*')
+        else:
+            clauses.append(_quote(' '.join(run[i:i + 2] for i in range(len(run) - 1))))
+    return ' AND '.join(clauses) if clauses else None
+
+def connect(index_path=DEFAULT_INDEX_PATH):
+    return connect_db(index_path, _SCHEMA)
+
+def _delete_video(conn, video):
+    conn.execute('DELETE FROM segment_fts WHERE rowid IN (SELECT id FROM segments WHERE video = ?)', (video,))
+    conn.execute('DELETE FROM segments WHERE video = ?', (video,))
+    conn.execute('DELETE FROM videos WHERE video = ?', (video,))
+
+def index_vtt(vtt_path, video, index_path=DEFAULT_INDEX_PATH, force=False):
+    """
+    将一个 VTT 文件的所有字幕段写入索引。VTT 大小和修改时间未变化时跳过。
+    同一视频的旧记录会在同一事务中被替换。返回写入的字幕段数，跳过时返回 None。
+    """
+    stat = os.stat(vtt_path)
+    conn = connect(index_path)
+    try:
+        if not force:
+            row = conn.execute('SELECT vtt_size, vtt_mtime_ns FROM videos WHERE video = ?', (video,)).fetchone()
+            if row is not None and tuple(row) == (stat.st_size, stat.st_mtime_ns):
+                return None
+
+        with open(vtt_path, 'r', encoding='utf-8') as f:
+            segments = parse_vtt_to_segments(f.read())
+
+        with conn:
+            _delete_video(conn, video)
+            for i, segment in enumerate(segments):
+                cursor = conn.execute(
+                    'INSERT INTO segments (video, segment, start_ms, end_ms, text) VALUES (?, ?, ?, ?, ?)',
+                    (video, i, timestamp_to_ms(segment['start']), timestamp_to_ms(segment['end']), segment['text'])
+                )
+                conn.execute('INSERT INTO segment_fts (rowid, tokens) VALUES (?, ?)',
+                             (cursor.lastrowid, ' '.join(tokenize_for_index(segment['text']))))
+            conn.execute(
+                'INSERT INTO videos (video, vtt_size, vtt_mtime_ns, segment_count, indexed_at) VALUES (?, ?, ?, ?, ?)',
+                (video, stat.st_size, stat.st_mtime_ns, len(segments),
+                 datetime.datetime.now().isoformat(timespec='seconds'))
+            )
+        return len(segments)
+    finally:
+        conn.close()
+
+def remove_video(video, index_path=DEFAULT_INDEX_PATH):
+    """从索引中删除一个视频的所有字幕段。"""
+    conn = connect(index_path)
+    try:
+        with conn:
+            _delete_video(conn, video)
+    finally:
+        conn.close()
+
+def sync_index(data_folder=DATA_FOLDER, index_path=DEFAULT_INDEX_PATH):
+    """
+    增量同步 data/<base>/<base>.vtt 与索引：新增或变化的文件重新索引，已删除的文件从索引中移除。
+    返回 (重新索引的视频数, 移除的视频数)。
+    """
+    present = set()
+    updated = 0
+    for name in sorted(os.listdir(data_folder)):
+        vtt_path = os.path.join(data_folder, name, f"{name}.vtt")
+        if not os.path.isfile(vtt_path):
+            continue
+        present.add(name)
+        try:
+            if index_vtt(vtt_path, name, index_path) is not None:
+                updated += 1
+        except Exception as e:
+            print(f"索引字幕文件 '{vtt_path}' 时出错: {e}")
+
+    conn = connect(index_path)
+    try:
+        stale = [row[0] for row in conn.execute('SELECT video FROM videos') if row[0] not in present]
+        with conn:
+            for video in stale:
+                _delete_video(conn, video)
+    finally:
+        conn.close()
+    return updated, len(stale)
+
+def search(query, limit=20, offset=0, index_path=DEFAULT_INDEX_PATH):
+    """
+    在所有字幕中检索 query，按 BM25 相关度排序返回命中的字幕段。
+    每条结果包含 filename, segment, start_ms, end_ms, text, score (越大越相关)。
+    """
+    match = build_match_query(query)
+    if not match:
+        return []
+    conn = connect(index_path)
+    try:
+        rows = conn.execute(
+            """
+            SELECT s.video, s.segment, s.start_ms, s.end_ms, s.text, bm25(segment_fts) AS bm25_score
+            FROM segment_fts JOIN segments s ON s.id = segment_fts.rowid
+            WHERE segment_fts MATCH ?
+            ORDER BY bm25_score
+            LIMIT ? OFFSET ?
+            """,
+            (match, limit, offset)
+        ).fetchall()
+    finally:
+        conn.close()
+    return [{
+        'filename': video,
+        'segment': segment,
+        'start_ms': start_ms,
+        'end_ms': end_ms,
+        'text': text,
+        'score': round(-bm25_score, 4)
+    } for video, segment, start_ms, end_ms, text, bm25_score in rows]
+
+if __name__ == '__main__':
+    # 用法:
+    #   python search_index.py sync          同步 data/ 下的所有字幕文件
+    #   python search_index.py search 关键词  检索字幕
+    if len(sys.argv) >= 2 and sys.argv[1] == 'sync':
+        updated, removed = sync_index()
+        print(f"索引同步完成: 更新 {updated} 个视频, 移除 {removed} 个视频。")
+    elif len(sys.argv) >= 3 and sys.argv[1] == 'search':
+        for hit in search(' '.join(sys.argv[2:])):
+            print(f"[{hit['score']:.2f}] {hit['filename']} @ {hit['start_ms']}ms: {hit['text']}")
+    else:
+        print("用法: python search_index.py sync | search <关键词>")
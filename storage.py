@@ -0,0 +1,52 @@
+import os
+import re
+import sqlite3
+import unicodedata
+
+# --- 数据目录：上传文件、字幕、摘要和所有 SQLite 数据库都保存在这里 ---
+DATA_FOLDER = 'data'
+
+# CJK 统一表意文字、扩展 A、兼容表意文字、日文假名和韩文音节 (用于正则字符类)
+CJK_CHARS = '\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3040-\u30ff\uac00-\ud7af'
+
+# 文件名中保留的字符：Unicode 字母、数字、下划线、点和连字符，其余字符被删除
+_UNSAFE_FILENAME_RE = re.compile(r'[^\w.-]')
+_WINDOWS_DEVICE_NAMES = {'CON', 'PRN', 'AUX', 'NUL', *(f'COM{i}' for i in range(1, 10)),
+                         *(f'LPT{i}' for i in range(1, 10))}
+
+def safe_filename(filename):
+    """
+    与 werkzeug 的 secure_filename 规则相同 (路径分隔符和空白变为下划线，删除其他符号)，
+    但保留中文等非 ASCII 字母和数字，使 data/ 下的目录名仍然可读。ASCII 文件名的结果与 secure_filename 一致。
+    """
+    filename = unicodedata.normalize('NFC', filename)
+    for sep in (os.sep, os.path.altsep, '/', '\\'):
+        if sep:
+            filename = filename.replace(sep, ' ')
+    filename = _UNSAFE_FILENAME_RE.sub('', '_'.join(filename.split())).strip('._')
+    if os.name == 'nt' and filename and filename.split('.')[0].upper() in _WINDOWS_DEVICE_NAMES:
+        filename = f"_{filename}"
+    return filename
+
+def data_path(*parts):
+    """返回 data 目录下的路径。"""
+    return os.path.join(DATA_FOLDER, *parts)
+
+def connect_db(db_path, schema, pragmas=()):
+    """
+    打开 (必要时创建) SQLite 数据库并执行建表语句，行以 sqlite3.Row 返回。
+    所有数据库统一使用 WAL 日志和 synchronous=NORMAL。pragmas 只在新建数据库文件时执行
+    (例如 auto_vacuum 必须在建表之前设置)；已有数据库上执行它们需要写锁，会让只读连接等待其他写事务。
+    连接不能跨线程共享，每个线程应各自打开。
+    """
+    os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+    created = not os.path.exists(db_path) or os.path.getsize(db_path) == 0
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    if created:
+        for pragma in pragmas:
+            conn.execute(f'PRAGMA {pragma}')
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(schema)
+    return conn
@@ -0,0 +1,194 @@
+import os
+import json
+import time
+import threading
+import contextlib
+import llm_cache
+from transcript_compaction import compact_segments, count_tokens, format_numbered_blocks, tokenizer_name
+
+SYSTEM_PROMPT = "你是一位专业的视频内容结构分析师。请以 JSON 格式返回结果。"
+
+# 正在生成的缓存键 -> (锁, 等待者数)，同一键的并发请求只调用一次 OpenAI
+_generating = {}
+_generating_lock = threading.Lock()
+
+def request_summary_json(client, model, prompt_template, formatted_vtt):
+    """
+    将带索引的字幕文本与 Prompt 模板拼接后请求 OpenAI，返回 JSON 摘要字符串。
+    """
+    final_prompt = prompt_template + "\n\n" + formatted_vtt
+    response = client.chat.completions.create(
+        model=model,
+        messages=[
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": final_prompt}
+        ],
+        response_format={"type": "json_object"}
+    )
+    return response.choices[0].message.content
+
+def summarize_transcript(client, model, prompt_template, segments, compaction=None):
+    """
+    请求字幕摘要。compaction 为 compact_segments 的参数时，先将字幕段合并为段落块再发送。
+    返回 (JSON 摘要字符串, 块索引映射, 统计信息)；未压缩时块索引映射为 None。
+    """
+    original_text = format_numbered_blocks([segment['text'] for segment in segments])
+    block_map = None
+    formatted_text = original_text
+    if compaction is not None:
+        compacted = compact_segments(segments, **compaction)
+        formatted_text = compacted.text
+        block_map = compacted.block_map
+
+    started = time.time()
+    summary_json_str = request_summary_json(client, model, prompt_template, formatted_text)
+    latency = time.time() - started
+
+    original_tokens = count_tokens(original_text)
+    sent_tokens = count_tokens(formatted_text)
+    stats = {
+        'segments': len(segments),
+        'blocks': len(block_map) if block_map is not None else len(segments),
+        'original_tokens': original_tokens,
+        'sent_tokens': sent_tokens,
+        'saved_tokens': original_tokens - sent_tokens,
+        'saved_ratio': round(1 - sent_tokens / original_tokens, 4) if original_tokens else 0.0,
+        'tokenizer': tokenizer_name(),
+        'latency_seconds': round(latency, 3)
+    }
+    print(f"摘要请求统计: {stats['segments']} 段 -> {stats['blocks']} 块, "
+          f"字幕 token {original_tokens} -> {sent_tokens} (节省 {stats['saved_ratio']:.1%}, {stats['tokenizer']}), "
+          f"耗时 {latency:.2f} 秒")
+    return summary_json_str, block_map, stats
+
+def summary_cache_key(model, prompt_template, segments, compaction=None):
+    """
+    计算摘要结果的缓存键。除字幕、Prompt 和模型外，系统提示词和压缩参数也参与计算。
+    返回 (cache_key, transcript_hash, prompt_hash, params)。
+    """
+    params = {'system_prompt': SYSTEM_PROMPT, 'compaction': compaction}
+    key, transcript_hash, prompt_hash = llm_cache.make_cache_key(segments, prompt_template, model, params)
+    return key, transcript_hash, prompt_hash, params
+
+def cached_summary(model, prompt_template, segments, compaction=None, video=None):
+    """
+    查询摘要结果缓存。返回 (缓存条目或 None, 缓存键信息)，键信息用于未命中时调用 generate_cached_summary。
+    """
+    key_info = summary_cache_key(model, prompt_template, segments, compaction)
+    return llm_cache.get(key_info[0], video), key_info
+
+@contextlib.contextmanager
+def _generation_lock(key):
+    with _generating_lock:
+        lock, waiters = _generating.get(key, (threading.Lock(), 0))
+        _generating[key] = (lock, waiters + 1)
+    try:
+        with lock:
+            yield
+    finally:
+        with _generating_lock:
+            lock, waiters = _generating[key]
+            if waiters == 1:
+                del _generating[key]
+            else:
+                _generating[key] = (lock, waiters - 1)
+
+def generate_cached_summary(client, model, prompt_template, segments, video, key_info, compaction=None,
+                            max_cache_bytes=llm_cache.DEFAULT_MAX_CACHE_BYTES):
+    """
+    请求摘要、生成 Markdown 并写入结果缓存。同一缓存键的并发调用会等待第一个请求完成并复用其结果。
+    返回 (缓存条目, 是否由本次调用生成)。
+    """
+    key, transcript_hash, prompt_hash, params = key_info
+    with _generation_lock(key):
+        entry = llm_cache.get(key, video, coalesced=True)
+        if entry is not None:
+            print(f"复用同时进行的摘要请求结果: '{video}' ({key[:12]})")
+            return entry, False
+        summary_json_str, block_map, stats = summarize_transcript(client, model, prompt_template, segments,
+                                                                  compaction=compaction)
+        markdown_summary = render_summary_markdown(summary_json_str, segments, block_map)
+        entry = llm_cache.put(key, video, model, transcript_hash, prompt_hash, params, summary_json_str, block_map,
+                              markdown_summary, stats=stats, max_bytes=max_cache_bytes)
+        return entry, True
+
+def write_summary_artifacts(video_folder, base_filename, entry):
+    """
+    将缓存条目导出为视频目录中的最新摘要文件 (<base>.md, <base>-summary.json, <base>-blocks.json)。
+    返回 (Markdown 路径, JSON 路径)。
+    """
+    summary_filepath = os.path.join(video_folder, f"{base_filename}.md")
+    json_summary_filepath = os.path.join(video_folder, f"{base_filename}-summary.json")
+    block_map_filepath = os.path.join(video_folder, f"{base_filename}-blocks.json")
+
+    with open(json_summary_filepath, 'w', encoding='utf-8') as f:
+        f.write(entry['summary_json'])
+    if entry['block_map'] is not None:
+        with open(block_map_filepath, 'w', encoding='utf-8') as f:
+            json.dump(entry['block_map'], f)
+    elif os.path.exists(block_map_filepath):
+        os.remove(block_map_filepath)
+    with open(summary_filepath, 'w', encoding='utf-8') as f:
+        f.write(entry['markdown'])
+    return summary_filepath, json_summary_filepath
+
+def render_summary_markdown(summary_json_str, segments, block_map=None):
+    """
+    将 JSON 摘要字符串转换为 Markdown，时间戳通过 VTT segments 获取。
+    摘要基于压缩块生成时，需传入 block_map 将块索引映射回原始 segment。
+    """
+    summary_data = json.loads(summary_json_str)
+    # OpenAI 返回的 JSON 可能包含在一个根键中（如 {"summary": [...]}），也可能直接是列表
+    summary_root = []
+    if isinstance(summary_data, dict):
+        summary_root = summary_data.get('summary', summary_data)
+    else:
+        summary_root = summary_data # 如果是列表，直接使用
+
+    # generate_markdown_from_json 函数内部会处理 summary_root 是字典还是列表的情况
+    return generate_markdown_from_json(summary_root, segments, block_map=block_map)
+
+def generate_markdown_from_json(data, segments, level=1, block_map=None):
+    """根据 01.0101--.md 的格式，并使用 VTT segments 来获取时间戳。"""
+    markdown = ""
+    if isinstance(data, dict):
+        data = [data]
+
+    for node in data:
+        title = node.get('title', '无标题')
+        description = node.get('description', '')
+        index = node.get('index')
+        # 压缩块索引 -> 块内第一个原始 segment 索引
+        if block_map is not None:
+            index = block_map[index][0] if isinstance(index, int) and 0 <= index < len(block_map) else None
+
+        # --- 通过索引从 segments 列表中获取时间戳 ---
+        timestamp_str = "00:00:00"
+        if index is not None and 0 <= index < len(segments):
+            timestamp = segments[index]['start']
+            # 格式化时间戳，去掉毫秒部分
+            timestamp_str = timestamp.split('.')[0]
+
+        timestamp_link = f"[{timestamp_str}](#{timestamp_str})"
+
+        if level == 1:
+            markdown += f"## {title} {timestamp_link}\n\n"
+            if description:
+                markdown += f"{description}\n\n"
+        elif level == 2:
+            markdown += f"### **{title}** {timestamp_link}\n\n"
+            if description:
+                markdown += f"{description}\n\n"
+        else:
+            indent = "  " * (level - 3)
+            line = f"{indent}- **{title}**"
+            if description:
+                line += f" ：{description}"
+            line += f" {timestamp_link}\n"
+            markdown += line
+
+        # 递归处理子节点
+        if 'children' in node and node['children']:
+            markdown += generate_markdown_from_json(node['children'], segments, level + 1, block_map)
+
+    return markdown
@@ -0,0 +1,156 @@
+import re
+import math
+from storage import CJK_CHARS
+from vtt_utils import timestamp_to_ms
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# --- 默认压缩参数 ---
+DEFAULT_MAX_BLOCK_TOKENS = 200
+DEFAULT_MAX_GAP_SECONDS = 3.0
+TIKTOKEN_ENCODING = 'cl100k_base'
+
+_CJK_RE = re.compile(f'[{CJK_CHARS}]')
+_WORD_RE = re.compile(f'[{CJK_CHARS}]|[^\\W_]+|[^\\w\\s]')
+
+# 独立出现的单个语气词/填充词 (前后为标点、空白或句首句尾时才删除，避免误删词语中的字)。
+# 不包含 "you know" 之类的多词短语：它们常常是正文的一部分 ("Do you know him?")
+_FILLER_RE = re.compile(
+    r'(?:^|(?<=[\s，,。.!！?？、；;]))'
+    r'(?:嗯+|呃+|额+|唔+|啊+|哦+|um+|uh+|erm|hmm+)'
+    r'(?=$|[\s，,。.!！?？、；;])[\s，,、；;]*',
+    re.IGNORECASE
+)
+
+_ENCODING = None
+_ENCODING_FAILED = False
+
+def _get_encoding():
+    global _ENCODING, _ENCODING_FAILED
+    if _ENCODING is None and tiktoken is not None and not _ENCODING_FAILED:
+        try:
+            _ENCODING = tiktoken.get_encoding(TIKTOKEN_ENCODING)
+        except Exception as e:
+            # 首次使用需要下载编码文件，离线时退回估算
+            print(f"加载 tiktoken 编码 '{TIKTOKEN_ENCODING}' 失败，改用估算: {e}")
+            _ENCODING_FAILED = True
+    return _ENCODING
+
+def tokenizer_name():
+    """返回 count_tokens 使用的计数方式：tiktoken 编码名，或无法使用 tiktoken 时的 'estimate'。"""
+    return f"tiktoken:{TIKTOKEN_ENCODING}" if _get_encoding() is not None else 'estimate'
+
+def count_tokens(text):
+    """
+    统计文本的 token 数。可以使用 tiktoken 时按本地 BPE 编码精确计数，
+    否则按 CJK 单字 1 个 token、拉丁单词约 4 个字符 1 个 token、标点 1 个 token 估算。
+    """
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    tokens = 0
+    for word in _WORD_RE.findall(text):
+        if _CJK_RE.match(word):
+            tokens += 1
+        else:
+            tokens += math.ceil(len(word) / 4)
+    return tokens
+
+def remove_fillers(text):
+    """
+    删除独立出现的填充词，并去掉因此残留在开头的标点。
+
+    >>> remove_fillers('嗯嗯。对')
+    '对'
+    >>> remove_fillers('Um, do you know what I mean?')
+    'do you know what I mean?'
+    >>> remove_fillers('Do you know him?')
+    'Do you know him?'
+    >>> remove_fillers('嗯，我们开始吧')
+    '我们开始吧'
+    >>> remove_fillers('呃...')
+    ''
+    """
+    text = _FILLER_RE.sub('', text)
+    return text.strip().lstrip('，,、；;。.!！?？…').strip()
+
+def _join(left, right):
+    # 与拉丁文字相邻时保留空格，CJK 文本之间直接拼接
+    if left and right and ((left[-1].isascii() and left[-1].isalnum()) or (right[0].isascii() and right[0].isalnum())):
+        return left + ' ' + right
+    return left + right
+
+def format_numbered_blocks(texts):
+    """按 prompt_summary.txt 约定的格式输出: 索引行 + 内容行 + 空行。"""
+    formatted_output = []
+    for i, text in enumerate(texts):
+        formatted_output.append(str(i))
+        formatted_output.append(text)
+        formatted_output.append("")
+    return "\n".join(formatted_output)
+
+class CompactedTranscript:
+    """
+    压缩后的字幕文本。
+    block_map[i] 是第 i 个压缩块包含的原始 segment 索引列表，用于把 LLM 返回的块索引映射回原始时间戳。
+    """
+
+    def __init__(self, blocks, block_map):
+        self.blocks = blocks
+        self.block_map = block_map
+        self.text = format_numbered_blocks(blocks)
+
+def compact_segments(segments, max_block_tokens=DEFAULT_MAX_BLOCK_TOKENS,
+                     max_gap_seconds=DEFAULT_MAX_GAP_SECONDS, drop_fillers=True):
+    """
+    将相邻的 Whisper 字幕段合并为段落大小的块。
+    当块的 token 数将超过 max_block_tokens，或两段之间的静音超过 max_gap_seconds 时开始新块。
+    只包含填充词的字幕段会被丢弃，但不影响其他段的索引映射。
+    """
+    blocks = []
+    block_map = []
+    current_text = ''
+    current_indices = []
+    current_tokens = 0
+    previous_end_ms = None
+
+    for i, segment in enumerate(segments):
+        text = remove_fillers(segment['text']) if drop_fillers else segment['text'].strip()
+        if not text:
+            continue
+        tokens = count_tokens(text)
+        start_ms = timestamp_to_ms(segment['start'])
+
+        gap_too_long = previous_end_ms is not None and max_gap_seconds is not None and \
+            start_ms - previous_end_ms > max_gap_seconds * 1000
+        if current_indices and (current_tokens + tokens > max_block_tokens or gap_too_long):
+            blocks.append(current_text)
+            block_map.append(current_indices)
+            current_text, current_indices, current_tokens = '', [], 0
+
+        current_text = _join(current_text, text)
+        current_indices.append(i)
+        current_tokens += tokens
+        previous_end_ms = timestamp_to_ms(segment['end'])
+
+    if current_indices:
+        blocks.append(current_text)
+        block_map.append(current_indices)
+    return CompactedTranscript(blocks, block_map)
+
+def compaction_options(config):
+    """
+    从 config.json 的 "compaction" 配置生成 compact_segments 的参数。
+    配置中 enabled 为 false 时返回 None，表示不压缩。
+    """
+    config = config or {}
+    if not config.get('enabled', True):
+        return None
+    return {
+        'max_block_tokens': config.get('max_block_tokens', DEFAULT_MAX_BLOCK_TOKENS),
+        'max_gap_seconds': config.get('max_gap_seconds', DEFAULT_MAX_GAP_SECONDS),
+        'drop_fillers': config.get('drop_fillers', True)
+    }
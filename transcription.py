@@ -3,7 +3,14 @@ import whisper
 import os
 import math
 import glob
+import catalog
+from storage import DATA_FOLDER
 from vtt_utils import parse_vtt_to_segments
+from search_index import index_vtt
+from pcm_cache import load_audio_cached, pcm_cache_path, to_float32, DEFAULT_MAX_CACHE_BYTES
+
+# --- 文件类型配置 ---
+ALLOWED_EXTENSIONS = {'mp4', 'mp3', 'wav'}
 
 def load_whisper_model(model_name="large"):
     """
@@ -34,44 +41,58 @@ def format_timestamp(seconds: float) -> str:
     seconds, milliseconds = divmod(milliseconds, 1_000)
     return f"{int(hours):02d}:{int(minutes):02d}:{int(seconds):02d}.{int(milliseconds):03d}"
 
-def transcribe_audio(model, audio_file, socketio=None, base_filename=None, original_filename=None, chunk_seconds=30):
+def transcribe_audio(model, audio_file, socketio=None, base_filename=None, original_filename=None, chunk_seconds=30,
+                     pcm_cache_dtype='float32', pcm_cache_max_bytes=DEFAULT_MAX_CACHE_BYTES, job=None):
     """
     使用加载好的模型对指定的音频文件进行转写，并通过 Socket.IO 发送实时进度。
+    解码后的 PCM 会缓存在视频专属目录中，续传或重新转写时通过内存映射读取，无需再次调用 ffmpeg。
+    传入 job (jobs.TranscriptionJob) 时，每个分块之前都会检查取消、暂停和优先级抢占。
+    成功时返回最终 VTT 文件路径，失败或被取消时返回 None。
     """
-    # --- 目录配置 ---
-    DATA_FOLDER = 'data'
     os.makedirs(DATA_FOLDER, exist_ok=True)
 
     if not model:
         print("模型未加载，无法进行转写。")
         return
 
-    # --- 加载音频文件 ---
+    # 如果没有提供 base_filename，则从 audio_file 推断
+    if not base_filename:
+        base_filename = os.path.splitext(os.path.basename(audio_file))[0]
+
+    # 为每个视频在 data 目录下创建一个专属的子目录
+    video_folder = os.path.join(DATA_FOLDER, base_filename)
+    os.makedirs(video_folder, exist_ok=True)
+
+    # --- 加载音频文件 (优先使用 PCM 缓存) ---
     try:
         print(f"正在加载音频文件: '{audio_file}'...")
-        audio = whisper.load_audio(audio_file)
+        audio = load_audio_cached(audio_file, pcm_cache_path(video_folder, base_filename),
+                                  dtype=pcm_cache_dtype, max_cache_bytes=pcm_cache_max_bytes)
         sample_rate = whisper.audio.SAMPLE_RATE
         total_samples = audio.shape[0]
         total_seconds = total_samples / sample_rate
         print(f"音频加载成功: 总时长 = {total_seconds:.2f} 秒。")
     except Exception as e:
         print(f"加载音频文件时出错: {e}")
+        catalog.fail_transcription(base_filename, f"加载音频文件时出错: {e}")
         return
 
     # --- 边转写边生成临时 VTT 文件 (支持断点续传) ---
     print("\n--- 开始分块转写并实时生成 VTT 片段 ---")
     num_chunks = math.ceil(total_seconds / chunk_seconds)
     chunk_samples = chunk_seconds * sample_rate
-    # 如果没有提供 base_filename，则从 audio_file 推断
-    if not base_filename:
-        base_filename = os.path.splitext(os.path.basename(audio_file))[0]
-    
-    # 为每个视频在 data 目录下创建一个专属的子目录
-    video_folder = os.path.join(DATA_FOLDER, base_filename)
     temp_dir = os.path.join(video_folder, 'tmp') # 临时文件存放在 video_folder/tmp/
     os.makedirs(temp_dir, exist_ok=True)
     print(f"临时文件将保存在目录: '{temp_dir}/'")
 
+    # --- 在目录中登记转写任务 (批处理直接调用时补充计算内容哈希) ---
+    media = catalog.get_media(base_filename)
+    if not media or not media['content_hash']:
+        catalog.upsert_media(base_filename, content_hash=catalog.file_sha256(audio_file),
+                             original_filename=original_filename or os.path.basename(audio_file))
+    catalog.start_transcription(base_filename, audio_file, total_seconds, num_chunks,
+                                len(glob.glob(os.path.join(temp_dir, "*.vtt.tmp"))))
+
     # --- 任务开始时，立即发送一个空数组作为启动信号 ---
     if socketio:
         socketio.emit('new_subtitle_chunk', {
@@ -82,6 +103,20 @@ def transcribe_audio(model, audio_file, socketio=None, base_filename=None, origi
         socketio.sleep(0.01)
 
     for i in range(num_chunks):
+        # --- 分块边界：检查取消/暂停/抢占 (暂停时在此阻塞，已完成的分块在恢复后直接复用) ---
+        if job and not job.checkpoint():
+            print(f"转写任务 '{base_filename}' 已取消 (原因: {job.cancel_reason})，停止于块 {i+1}/{num_chunks}。")
+            catalog.cancel_transcription(base_filename, job.cancel_reason)
+            if socketio:
+                socketio.emit('transcription_cancelled', {
+                    'filename': base_filename,
+                    'original_filename': original_filename,
+                    'reason': job.cancel_reason,
+                    'chunks_done': i,
+                    'num_chunks': num_chunks
+                })
+            return None
+
         start_time = i * chunk_seconds
         end_time = (i + 1) * chunk_seconds
         
@@ -113,7 +148,7 @@ def transcribe_audio(model, audio_file, socketio=None, base_filename=None, origi
 
         start_sample = i * chunk_samples
         end_sample = start_sample + chunk_samples
-        audio_chunk = audio[start_sample:end_sample]
+        audio_chunk = to_float32(audio[start_sample:end_sample])
 
         result_chunk = model.transcribe(audio_chunk, verbose=None)
 
@@ -168,6 +203,10 @@ def transcribe_audio(model, audio_file, socketio=None, base_filename=None, origi
                 })
                 socketio.sleep(0.01)
 
+        catalog.update_progress(base_filename, i + 1)
+
+    final_vtt_path = None
+
     # --- 合并所有临时 VTT 文件 ---
     temp_files_pattern = os.path.join(temp_dir, "*.vtt.tmp")
     temp_files = sorted(glob.glob(temp_files_pattern))
@@ -184,6 +223,16 @@ def transcribe_audio(model, audio_file, socketio=None, base_filename=None, origi
                     final_f.writelines(lines[2:])
 
         print(f"--- 合并完成, 字幕文件已保存到: '{final_vtt_path}' ---")
+        catalog.complete_transcription(base_filename, final_vtt_path)
+
+        # --- 更新全文检索索引 ---
+        try:
+            indexed = index_vtt(final_vtt_path, base_filename)
+            if indexed is not None:
+                print(f"--- 已将 {indexed} 条字幕写入检索索引 ---")
+        except Exception as e:
+            print(f"更新检索索引时出错: {e}")
+
         if socketio:
             print(f"发送 WebSocket 事件: transcription_complete for {base_filename}")
             socketio.emit('transcription_complete', {
@@ -193,6 +242,7 @@ def transcribe_audio(model, audio_file, socketio=None, base_filename=None, origi
             })
     else:
         print("\n--- 未生成任何临时文件，任务结束 ---")
+        catalog.fail_transcription(base_filename, '未生成任何字幕文件')
         if socketio:
             print(f"发送 WebSocket 事件: transcription_error for {base_filename}")
             socketio.emit('transcription_error', {
@@ -207,6 +257,7 @@ def transcribe_audio(model, audio_file, socketio=None, base_filename=None, origi
     # print("\n--- 临时文件已删除 ---")
 
     print("\n--- 转写任务结束 ---")
+    return final_vtt_path
 
 
 if __name__ == '__main__':
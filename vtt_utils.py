@@ -27,3 +27,13 @@ def parse_vtt_to_segments(vtt_content):
         pass
         
     return segments
+
+def timestamp_to_ms(timestamp):
+    """
+    将 VTT 时间戳 (HH:MM:SS.mmm 或 MM:SS.mmm) 转换为毫秒整数。
+    """
+    parts = timestamp.strip().split(':')
+    seconds = float(parts[-1])
+    minutes = int(parts[-2]) if len(parts) >= 2 else 0
+    hours = int(parts[-3]) if len(parts) >= 3 else 0
+    return int(round(((hours * 60 + minutes) * 60 + seconds) * 1000))